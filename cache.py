@@ -0,0 +1,101 @@
+'''
+已渲染帧的磁盘缓存
+
+相同文件 + 相同编码参数重复传输时，直接读取上次编码好的 L2 帧（缩放前的原始尺寸），
+跳过 wirehair/qrcode 编码。缓存目录下每个条目对应一个 key，条目内每帧一个 npz 文件。
+'''
+import hashlib
+import os
+import shutil
+import numpy as np
+
+CACHE_FORMAT = 2    # 帧格式变化时递增，旧缓存自动失效
+
+def frame_cache_key(file_data, **layout):
+    '''文件内容 hash + 编码参数（method/version/box size/payload 布局等）'''
+    file_hash = hashlib.sha256(file_data).hexdigest()
+    desc = ','.join(f'{k}={layout[k]}' for k in sorted(layout))
+    return hashlib.sha256(f'{CACHE_FORMAT}:{file_hash}:{desc}'.encode()).hexdigest()[:32]
+
+def dir_size(path):
+    total = 0
+    try:
+        for entry in os.scandir(path):
+            if entry.is_file():
+                total += entry.stat().st_size
+    except FileNotFoundError:   # 其它进程正在淘汰该条目
+        pass
+    return total
+
+class FrameCache:
+    def __init__(self, cache_dir, key, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.entry_dir = os.path.join(cache_dir, key)
+        self.max_bytes = max_bytes
+        self.check_bytes = max(max_bytes // 32, 1 << 20)   # 每写入这么多字节重新检查一次总大小
+        self.unchecked = 0
+        self.full = False   # 当前条目本身已超过上限，不再写入
+
+    def open(self):
+        '''创建/标记当前条目为最近使用，并按 LRU 淘汰其它条目，返回已缓存的帧数'''
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.utime(self.entry_dir)
+        self.evict()
+        return len([f for f in os.listdir(self.entry_dir) if f.endswith('.npz')])
+
+    def evict(self):
+        entries = []
+        total = current = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            size = dir_size(entry.path)
+            total += size
+            if entry.name != self.key:
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            else:
+                current = size
+        entries.sort()   # 最久未使用的在前
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        if current > self.max_bytes and not self.full:
+            self.full = True
+            print(f"Frame cache: entry exceeds {self.max_bytes >> 20}MB, stop caching new frames")
+
+    def path(self, idx):
+        return os.path.join(self.entry_dir, f'{idx}.npz')
+
+    def load(self, idx):
+        try:
+            with np.load(self.path(idx)) as f:
+                data, shape, packed = f['data'], tuple(f['shape']), bool(f['packed'])
+        except (OSError, ValueError, KeyError):
+            return None
+        if packed:
+            return np.unpackbits(data, count=int(np.prod(shape))).reshape(shape).astype(bool)
+        return data
+
+    def store(self, idx, arr):
+        '''写入一帧，写入的数据累计超过 check_bytes 时重新按 LRU 淘汰（每个生产者进程各自计数）'''
+        if self.full:
+            return
+        # qrcode 为 1 bit 图像，按位打包
+        packed = arr.dtype == bool
+        data = np.packbits(arr) if packed else arr
+        path = self.path(idx)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, data=data, shape=np.array(arr.shape), packed=packed)
+            os.replace(tmp, path)   # 多个生产者进程同时写入，保证读到的都是完整文件
+            self.unchecked += os.path.getsize(path)
+        except OSError as e:
+            print(f"Frame cache write failed: {e}")
+            return
+        if self.unchecked >= self.check_bytes:
+            self.unchecked = 0
+            self.evict()
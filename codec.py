@@ -0,0 +1,248 @@
+'''
+L2 编解码器注册表
+
+每种编码方式（qrcode/pixelbar/cimbar）实现同一套接口：
+    get_capacity() -> 单帧最大字节数
+    encode(data)   -> np.ndarray 图像
+    decode(img)    -> bytes 或 None（PIL.Image 或 np.ndarray）
+    encode_batch/decode_batch 一次处理一批帧，多进程时每个任务一批，摊薄进程间通信的开销
+依赖的第三方库只在第一次使用时导入，未选中的编码方式不会产生任何导入开销。
+每个进程使用自己的后端对象：pickle 时不带后端，fork 出的子进程调用 reset() 丢弃继承的后端。
+'''
+import base64
+import struct
+
+_CODECS = {}
+
+def register_codec(name):
+    def wrap(cls):
+        cls.name = name
+        _CODECS[name] = cls
+        return cls
+    return wrap
+
+def codec_names():
+    return list(_CODECS)
+
+def get_codec(name, **kwargs):
+    if name not in _CODECS:
+        raise ValueError(f"Invalid encoding method: {name}, choices: {codec_names()}")
+    return _CODECS[name](**kwargs)
+
+class L2Codec:
+    def __init__(self, qr_version=40, qr_box_size=1.5, qr_border=1, pixel_bits=8, qr_backend='auto'):
+        self.qr_version = qr_version
+        self.qr_box_size = qr_box_size
+        self.qr_border = qr_border
+        self.pixel_bits = pixel_bits
+        self.qr_backend = qr_backend
+        self.capacity = 0   # negotiate_capacity 确定的单帧字节数，随 pickle 传给子进程
+        self._backend = None
+
+    def __getstate__(self):
+        # 后端对象（如 cimbar、解码函数）不一定能 pickle，子进程中重新加载
+        state = self.__dict__.copy()
+        for k in state:
+            if k.startswith('_'):
+                state[k] = None
+        return state
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.load()
+        return self._backend
+
+    def reset(self):
+        '''丢弃已加载的后端，在子进程开始时调用，每个进程初始化一次自己的后端'''
+        for k in list(self.__dict__):
+            if k.startswith('_'):
+                setattr(self, k, None)
+
+    def load(self):
+        '''导入依赖并返回后端对象，只在第一次使用时调用'''
+        raise NotImplementedError
+
+    def negotiate_capacity(self, max_size=0):
+        '''确定单帧字节数：编码方式支持的最大值，或指定的更小的 max_size'''
+        capacity = self.get_capacity()
+        if max_size > capacity:
+            raise ValueError(f"{self.name}: frame size {max_size} exceeds capacity {capacity}")
+        self.capacity = max_size or capacity
+        return self.capacity
+
+    def get_capacity(self):
+        raise NotImplementedError
+
+    def encode(self, data):
+        raise NotImplementedError
+
+    def decode(self, img):
+        raise NotImplementedError
+
+    def encode_batch(self, datas):
+        return [self.encode(data) for data in datas]
+
+    def decode_batch(self, imgs):
+        return [self.decode(img) for img in imgs]
+
+    def calibration_frame(self):
+        '''颜色校准帧，不需要校准的编码方式返回 None'''
+        return None
+
+@register_codec('qrcode')
+class QRCodec(L2Codec):
+    _qr_decode = None       # 选定的 QR 解码后端
+    _auto_backends = None   # qr_backend='auto' 时待测试的后端
+    def load(self):
+        import qrcode
+        return qrcode
+
+    def get_capacity(self):
+        import qrcode.util
+        correction = self.backend.constants.ERROR_CORRECT_L
+        qr_maxbytes = qrcode.util.BIT_LIMIT_TABLE[correction][self.qr_version]//8
+        base32_valid = int(qr_maxbytes/1.0625/1.1)  # 理论计算结果超出限制，除以 1.1 简单修正一下
+        print(f"QR code version {self.qr_version} corr: L max bytes: {qr_maxbytes} base32_valid: {base32_valid}")
+        return base32_valid
+
+    def encode(self, data_):
+        import numpy as np
+        qrcode = self.backend
+        # qrcode 实际编码二进制数据时，实际对数据有要求，需要满足ISO/IEC 8859-1
+        # 导致编码和解码后，得到错误数据，解决办法为使用base32编码（损耗6.25%）
+        # https://github.com/tplooker/binary-qrcode-tests/tree/master
+        data = base64.b32encode(data_)
+        qr = qrcode.QRCode(
+            version=self.qr_version,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=int(self.qr_box_size),   # in pixels
+            border=self.qr_border,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        img = qr.make_image(fill_color="black", back_color="white")
+        return np.array(img)
+
+    def decode(self, img):
+        from qr_backend import to_gray
+        gray = to_gray(img)
+        if self._qr_decode is None:
+            if self.qr_backend == 'auto':
+                return self.decode_auto(gray)
+            from qr_backend import load_backend
+            self._qr_decode = load_backend(self.qr_backend)
+        data = self._qr_decode(gray)
+        if data is None:
+            return None
+        try:
+            return base64.b32decode(data)
+        except ValueError:
+            return None
+
+    def decode_auto(self, gray):
+        '''在第一帧能解出的图像上测试所有已安装的后端，之后固定使用最快的'''
+        from qr_backend import available_backends, pick_fastest
+        if self._auto_backends is None:
+            self._auto_backends = available_backends()
+            if not self._auto_backends:
+                raise ImportError("No QR decoder backend installed (pyzbar/opencv-python/zxing-cpp)")
+        def is_base32(data):
+            try:
+                base64.b32decode(data)
+                return True
+            except ValueError:
+                return False
+        # 等待第一帧时每个后端只试一次，能解出后才在这一帧上做多轮计时对比
+        for decode in self._auto_backends.values():
+            data = decode(gray)
+            if data is not None and is_base32(data):
+                break
+        else:
+            return None
+        name, data, result = pick_fastest(self._auto_backends, gray, check=is_base32)
+        if name is None:
+            return None
+        print("QR backend: " + ", ".join(f"{n} {t*1000:.1f}ms{'' if d is not None else '(failed)'}" for n, (t, d) in result.items()) + f" -> {name}")
+        self.qr_backend = name
+        self._qr_decode = self._auto_backends[name]
+        self._auto_backends = None
+        return base64.b32decode(data)
+
+@register_codec('pixelbar')
+class PixelBarCodec(L2Codec):
+    def load(self):
+        from pixelbar import PixelBar
+        return PixelBar(self.qr_version, box_size=int(self.qr_box_size), border_size=self.qr_border, pixel_bits=self.pixel_bits)
+
+    def get_capacity(self):
+        return self.backend.max_data_size
+
+    def encode(self, data):
+        import numpy as np
+        return np.array(self.backend.encode(data))
+
+    def decode(self, img):
+        return self.backend.decode(img, box_size=int(self.qr_box_size))
+
+    def calibration_frame(self):
+        import numpy as np
+        return np.array(self.backend.encode_calibration())
+
+@register_codec('cimbar')
+class CimbarCodec(L2Codec):
+    '''cimbar 每帧固定大小，帧内带 4 字节长度，解码时去掉填充'''
+    FRAME_HEADER = struct.Struct('I')
+    def load(self):
+        from pycimbar import cimbar
+        return cimbar.Cimbar()
+
+    def get_capacity(self):
+        return self.backend.get_capacity() - self.FRAME_HEADER.size
+
+    def encode(self, data):
+        capacity = self.capacity or self.get_capacity()
+        if len(data) > capacity:
+            raise ValueError(f"cimbar: {len(data)} bytes exceeds frame capacity {capacity}")
+        frame = self.FRAME_HEADER.pack(len(data)) + data
+        return self.backend.encode_np(frame + bytes(capacity + self.FRAME_HEADER.size - len(frame)))
+
+    def decode(self, img):
+        frame = self.backend.decode(img)
+        if frame is None or len(frame) < self.FRAME_HEADER.size:
+            return None
+        size, = self.FRAME_HEADER.unpack_from(frame)
+        if size > len(frame) - self.FRAME_HEADER.size:
+            return None
+        return bytes(frame[self.FRAME_HEADER.size:self.FRAME_HEADER.size + size])
+
+if __name__ == "__main__":
+    # 编解码速度对比：python codec.py -M qrcode pixelbar -N 20
+    import argparse
+    import os
+    from util import timer
+    parser = argparse.ArgumentParser(description="Benchmark L2 codecs.")
+    parser.add_argument("-M", "--method", nargs='+', default=codec_names(), choices=codec_names(), help="encoding methods to benchmark")
+    parser.add_argument("-Q", "--qr-version", type=int, default=40, help="QRcode version")
+    parser.add_argument("-B", "--qr-box-size", type=float, default=3, help="box size")
+    parser.add_argument("-N", "--num-frames", type=int, default=20, help="frames per method")
+    args = parser.parse_args()
+
+    for method in args.method:
+        try:
+            codec = get_codec(method, qr_version=args.qr_version, qr_box_size=args.qr_box_size)
+            tim = timer()
+            capacity = codec.negotiate_capacity()
+            load_time = tim.reset()
+            frames = [os.urandom(capacity) for _ in range(args.num_frames)]
+            encoded = codec.encode_batch(frames)
+            enc_time = tim.reset()
+            ok = sum(data == d for data, d in zip(codec.decode_batch(encoded), frames))
+            dec_time = tim.reset()
+        except ImportError as e:
+            print(f"{method:>8s}: unavailable ({e})")
+            continue
+        n = args.num_frames
+        print(f"{method:>8s}: capacity {capacity}B load {load_time*1000:.0f}ms "
+              f"encode {n/enc_time:.1f}fps decode {n/dec_time:.1f}fps ok {ok}/{n}")
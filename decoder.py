@@ -1,13 +1,15 @@
-import base64
 import os
 import argparse
 import struct
-from pyzbar.pyzbar import decode
+from queue import Empty
 from PIL import Image
 import multiprocessing
 import tqdm
+import numpy as np
+from collections import deque
+from codec import get_codec, codec_names
+from qr_backend import backend_names
 from util import *
-from pywirehair import decoder as wirehair_decoder
 
 def get_parser():
     parser = argparse.ArgumentParser(
@@ -17,75 +19,87 @@ def get_parser():
     # 从目录或者屏幕截图中获取数据
     parser.add_argument(
         "-m", "--mode",
-        default="screen_dxcam", choices=['dir', 'screen_mss', 'screen_dxcam', 'screen_win32'],
+        default="screen_dxcam", choices=['dir', 'screen_mss', 'screen_dxcam', 'screen_xshm', 'screen_win32', 'loopback'],
         help="input from dir or screen snapshot."
     )
     parser.add_argument("-i", "--input-dir", default='./out', help="dir: The dir containing the images to decode, use this for testing.")
     parser.add_argument(
-        "-R", "--region", default="",
-        help="Screen_mss: screen region to capture, format: mon_id:width:height:offset_left:offset_top. "
+        "-R", "--region", action="append",
+        help="Screen_mss/screen_xshm: screen region to capture, format: mon_id:width:height:offset_left:offset_top. "
+            "Repeat -R to capture K channels concurrently (fountain code only), loopback: one -R per channel. "
             "mon_id is the monitor id, default 1. "
             "widht/height: int|d|w|h, 'd' means default 3/4*min(w,h). "
             "Offset startwith '-' means from right/bottom, 'c' means center")
     parser.add_argument("-W", "--win-title", help="screen_win32: title of window to capture")
+    parser.add_argument("--loopback-name", default="auto_qrcode", help="loopback: shared memory name of the virtual screen")
+    parser.add_argument("--capture-fps", type=int, default=0, help="loopback: capture rate, 0 means unlimited")
+    parser.add_argument("--tear", type=float, default=0.0, help="loopback: probability of capturing a torn (half old/half new) frame")
     # L2
     parser.add_argument(
-        "-M", "--method", default="qrcode", choices=['qrcode', 'pixelbar', 'cimbar'], help="encoding method"
+        "-M", "--method", default="qrcode", choices=codec_names(), help="encoding method"
     )
     # 用于自动计算 region 大小，并非解码需要
     parser.add_argument(
         "-Q", "--qr-version", type=int, default=40, help="QRcode version"
     )
-    # pixelbar 还不支持自动识别 box_size，所以需要手动指定
+    # pixelbar 根据边框自动估计网格（支持小数 box size），估计失败时按 int(box_size) 采样
     parser.add_argument(
-        "-B", "--qr-box-size", type=float, default=1.5, help="QRcode box size"
+        "-B", "--qr-box-size", type=float, default=1.5, help="QRcode box size, pixelbar: fallback box size"
     )
     # # L3
     # parser.add_argument(
     #     "-F", "--not-use-fountain-code", dest='use_fountain_code', action='store_false', help="l3 encoding method"
     # )
+    parser.add_argument(
+        "--qr-backend", default="auto", choices=['auto'] + backend_names(),
+        help="qrcode decoder, auto: benchmark installed backends on the first decoded frame and use the fastest"
+    )
+    parser.add_argument("--pixel-bits", type=int, default=8, choices=[8, 16], help="pixelbar: bits per box, must match the encoder")
     parser.add_argument("-n", "--nproc", type=int, default=-1, help="multiprocess")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="images decoded per worker task (dir, and screen/loopback capture when nproc > 1)")
     return parser
 
+CHANNEL_DONE = 'done'   # 截屏进程退出时发送的标记，附带最终的截取数
+
+_worker = None  # 进程池中每个进程一个 Image2File，codec 只初始化一次
+
+def init_worker(i2f):
+    global _worker
+    i2f.codec.reset()
+    _worker = i2f
+
+def decode_files_worker(file_paths):
+    return _worker.decode_files(file_paths)
+
+def decode_frames_worker(imgs):
+    return _worker.decode_frames(imgs)
+
 class Image2File:
-    def __init__(self, method='qrcode', nproc=1, qr_box_size=1.5, qr_version=40):
+    def __init__(self, method='qrcode', nproc=1, qr_box_size=1.5, qr_version=40, pixel_bits=8, qr_backend='auto', batch_size=8):
         if nproc <= 0:
             self.nproc = multiprocessing.cpu_count() - 1
         else:
             self.nproc = nproc
         self.method = method
-        self.pb = None
         self.qr_box_size = qr_box_size
+        self.batch_size = max(1, batch_size)
         self.use_fountain_code = False
         self.dec = None
+        self.symbols = SymbolBitmap()   # 已送入 wirehair 的 symbol id
+        self.symbols_received = 0       # 收到的 symbol 数，包括重复的
+        self.fountain_data = None
         # 仅用于自动计算 region
         self.qr_version = qr_version
         self.qr_border = 1
-        self.cb = None  # cimbar
-
-    def decode_qrcode(self, img):
-        decoded = decode(img)
-        if len(decoded) == 0:
-            return None
-        data_ = decoded[0].data
-        return base64.b32decode(data_)
+        # pixelbar 解码需要 box_size，解码依赖在第一次解码时导入
+        self.codec = get_codec(method, qr_version=qr_version, qr_box_size=qr_box_size, qr_border=self.qr_border,
+                               pixel_bits=pixel_bits, qr_backend=qr_backend)
     
     def get_l3_pkt_from_l2(self, img):
         '''l2_pkt ->l3_pkt'''
-        if self.method == 'qrcode':
-            l2_pkt = self.decode_qrcode(img)
-        elif self.method == 'pixelbar':
-            if not self.pb:
-                from pixelbar import PixelBar
-                self.pb = PixelBar()
-            l2_pkt = self.pb.decode(img, box_size=int(self.qr_box_size))
-        elif self.method == 'cimbar':
-            if not self.cb:
-                from pycimbar import cimbar
-                self.cb = cimbar.Cimbar()
-            l2_pkt = self.cb.decode(img)
-        else:
-            raise ValueError("No encoding method specified.")
+        return self.l2_pkt_to_l3_pkt(self.codec.decode(img))
+
+    def l2_pkt_to_l3_pkt(self, l2_pkt):
         if l2_pkt is None or len(l2_pkt) == 0:
             return None
         try:
@@ -104,33 +118,83 @@ class Image2File:
         return idx, num_chunks, data
 
     def parse_l3_pkt_fountain_code(self, l3_pkt):
+        '''返回 (idx, file_data_size, l3_pl, new)，l3_pl 为 None 表示尚未解码完成
+        重复的 symbol 和解码完成后收到的 symbol 不再送入 wirehair
+        '''
         idx, file_data_size = struct.unpack('II', l3_pkt[:8])
+        self.symbols_received += 1
+        if self.fountain_data is not None or not self.symbols.add(idx):
+            return idx, file_data_size, self.fountain_data, False
         l3_pl_raw = l3_pkt[8:]
         l3_pl_size = len(l3_pl_raw)
         if not self.dec:
+            from pywirehair import decoder as wirehair_decoder
             self.dec = wirehair_decoder(file_data_size, l3_pl_size)
-        l3_pl = self.dec.decode(idx, l3_pl_raw)
-        return idx, file_data_size, l3_pl
+        self.fountain_data = self.dec.decode(idx, l3_pl_raw)
+        return idx, file_data_size, self.fountain_data, True
+    
+    def print_fountain_stats(self, num_chunks):
+        useful = len(self.symbols)
+        print(f"Fountain code: received {self.symbols_received} symbols, useful {useful}, duplicate {self.symbols_received - useful}, "
+              f"needed {num_chunks}, overhead {useful - num_chunks} ({(useful - num_chunks)/max(num_chunks, 1):.2%})")
     
-    def process_image(self, file_path, result_queue):
-        # not fountain code, decoding process
-        img = Image.open(file_path)
-        idx, _, data = self.parse_l3_pkt(self.get_l3_pkt_from_l2(img))
-        result_queue.put((idx, data))
-        # print(f'pid {os.getpid()}: file {file_path} image {idx}')
+    def decode_files(self, file_paths):
+        '''not fountain code, 一次解码一批图片，返回 [(idx, num_chunks, data), ...]，解不出的图片跳过'''
+        imgs = [Image.open(file_path) for file_path in file_paths]
+        result = []
+        for file_path, l2_pkt in zip(file_paths, self.codec.decode_batch(imgs)):
+            l3_pkt = self.l2_pkt_to_l3_pkt(l2_pkt)
+            if l3_pkt is None:
+                print(f"Failed to decode {file_path}")
+                continue
+            result.append(self.parse_l3_pkt(l3_pkt))
+        return result
     
-    def convert(self, output_file, mode='screen_win32', input_dir="", region='', win_title=''):
+    def decode_frames(self, imgs):
+        '''一次解码一批截图，返回 [l3_pkt 或 None, ...]'''
+        return [self.l2_pkt_to_l3_pkt(l2_pkt) for l2_pkt in self.codec.decode_batch(imgs)]
+
+    def iter_l3_pkt(self, capture_img, pool=None):
+        '''不断截屏并解码，返回 l3_pkt（解不出为 None）
+        pool 不为 None 时主进程只负责截屏，每 batch_size 张截图交给进程池解码（每个进程一个 codec），
+        按完成顺序返回：两种 L3 模式都按 idx 合并，不要求顺序
+        '''
+        if pool is None:
+            while True:
+                yield self.get_l3_pkt_from_l2(capture_img())
+        pending = deque()
+        while True:
+            while len(pending) < 2 * self.nproc:
+                # xshm 等返回复用缓冲区上的视图，提交前复制
+                imgs = [capture_img() for _ in range(self.batch_size)]
+                imgs = [np.array(img) if isinstance(img, np.ndarray) else img for img in imgs]
+                pending.append(pool.apply_async(decode_frames_worker, (imgs,)))
+            done = [r for r in pending if r.ready()] or [pending[0]]
+            for r in done:
+                pending.remove(r)
+                yield from r.get()
+
+    def convert(self, output_file, mode='screen_win32', input_dir="", regions=None, win_title='',
+                loopback_name='auto_qrcode', capture_fps=0, tear=0.0):
         tim = timer()
+        regions = regions or ['']
+        loopback = (loopback_name, capture_fps, tear)
         
-        if mode=='screen_mss':
-            self.input_from_screen(capture_method='mss', region=region)
+        if len(regions) > 1 and mode in ['screen_mss', 'screen_dxcam', 'screen_xshm', 'loopback']:
+            self.input_from_channels(capture_method=mode.replace('screen_', ''), regions=regions, loopback=loopback)
+        elif mode=='screen_mss':
+            self.input_from_screen(capture_method='mss', region=regions[0])
         elif mode=='screen_dxcam':
-            self.input_from_screen(capture_method='dxcam', region=region)
+            self.input_from_screen(capture_method='dxcam', region=regions[0])
+        elif mode=='screen_xshm':
+            self.input_from_screen(capture_method='xshm', region=regions[0])
         elif mode=='screen_win32':
             if not win_title:
                 print("win_title must be specified when use screen_win32 mode.")
                 exit(1)
             self.input_from_screen(capture_method='win32', win_title=win_title)
+        elif mode=='loopback':
+            self.input_from_screen(capture_method='loopback', loopback=loopback)
         elif mode=='dir':
             if self.use_fountain_code:
                 print("Fountain code not supported in dir mode for now.")
@@ -155,25 +219,30 @@ class Image2File:
         num_images = len(file_list)
         print(f"Found {num_images} images.")
         
-        pool = multiprocessing.Pool(processes=self.nproc)
-        manager = multiprocessing.Manager()
-        result_queue = manager.Queue()
-        
-        # parallel decode
-        for file in file_list:
-            pool.apply_async(self.process_image, (os.path.join(input_dir, file), result_queue))
-        pool.close()
-        # for file in file_list:
-        #     self.process_image(os.path.join(input_dir, file), result_queue)
-        
-        data_list = [b'' for _ in range(num_images)]
-        for i in tqdm.tqdm(range(num_images)):
-            idx, data = result_queue.get()
-            data_list[idx] = data
+        # parallel decode, 每个进程一个 codec，每个任务一批图片
+        file_paths = [os.path.join(input_dir, file) for file in file_list]
+        batches = [file_paths[i:i + self.batch_size] for i in range(0, num_images, self.batch_size)]
+        chunks = {}
+        num_chunks = 0
+        with multiprocessing.Pool(processes=self.nproc, initializer=init_worker, initargs=(self,)) as pool:
+            progress = tqdm.tqdm(total=num_images)
+            for batch, result in zip(batches, pool.imap(decode_files_worker, batches)):
+                for idx, n, data in result:
+                    chunks[idx] = data
+                    num_chunks = max(num_chunks, n)
+                progress.update(len(batch))
+            progress.close()
+        # 按 L3 头中的总块数检查，缺块时不输出不完整的文件
+        missing = [i for i in range(num_chunks) if i not in chunks]
+        if num_chunks == 0 or missing:
+            print(f"Missing {len(missing) if num_chunks else 'all'} of {num_chunks or '?'} chunks: {missing}")
+            exit(1)
         # concat
-        self.data_merged = b"".join([d for d in data_list])
+        self.data_merged = b"".join([chunks[i] for i in range(num_chunks)])
 
-    def input_from_screen(self, capture_method, region='', win_title=''):
+    def open_capture(self, capture_method, region='', win_title='', loopback=('auto_qrcode', 0, 0.0), channel=0):
+        '''返回 (capture_img, close_capture)'''
+        close_capture = lambda: None
         fit_pixel = int((self.qr_version * 4 + 21 + 2*self.qr_border) * self.qr_box_size) # default 1.5, version 40 -> 275x275, can be distinguished
         if capture_method == 'mss':
             import mss
@@ -210,11 +279,124 @@ class Image2File:
                 frame = camera.get_latest_frame()
                 # frame = camera.grab(region=region)
                 return Image.fromarray(frame)
+            close_capture = camera.stop
+        elif capture_method == 'xshm':
+            # Linux X11：共享内存截屏，返回复用缓冲区上的 numpy 视图，不经过 PIL
+            from xshm import XShmCapture, list_monitors
+            region_split = region.split(':')
+            mon_id = parse_region_mon(region_split)
+            mon = list_monitors()[mon_id]
+            width, height, x, y = parse_region(region_split[1:], mon["width"], mon["height"], fit_pixel=fit_pixel)
+            print(f'Screen: {mon_id}[{mon["width"]}x{mon["height"]}], Capture region: {width}x{height}+{x}+{y}')
+            xshm = XShmCapture(mon["left"] + x, mon["top"] + y, width, height)
+            capture_img = xshm.capture
+            close_capture = xshm.close
+        elif capture_method == 'loopback':
+            from loopback import LoopbackCapture, channel_name
+            name, capture_fps, tear = loopback
+            name = channel_name(name, channel)
+            lb_capture = LoopbackCapture(name, fps=capture_fps, tear=tear)
+            print(f"Loopback screen '{name}' {lb_capture.screen.width}x{lb_capture.screen.height} capture fps {capture_fps or 'unlimited'} tear {tear}")
+            capture_img = lb_capture.capture
+            close_capture = lb_capture.close
         else:
             from util_decode import get_hwnd, getSnapshot
             hwnd = get_hwnd(win_title)
             def capture_img():
                 return getSnapshot(hwnd)
+        return capture_img, close_capture
+
+    def capture_worker(self, channel, capture_method, region, loopback, symbol_queue, stop):
+        '''多 channel 时每个 channel 一个进程：截屏 + L2 解码，新的 l3_pkt 发给主进程合并
+        同时发送本 channel 截取到的 symbol 总数（包括本地丢弃的重复 symbol），退出时发送最终的总数，用于统计
+        '''
+        self.codec.reset()  # 每个 channel 使用自己的解码后端
+        capture_img, close_capture = self.open_capture(capture_method, region=region, loopback=loopback, channel=channel)
+        received = 0
+        try:
+            while not stop.is_set():
+                l3_pkt = self.get_l3_pkt_from_l2(capture_img())
+                if l3_pkt is None:
+                    continue
+                if not self.use_fountain_code:
+                    symbol_queue.put((channel, None, received))
+                    break
+                received += 1
+                idx = struct.unpack('I', l3_pkt[:4])[0]
+                if self.symbols.add(idx):   # 同一帧被截取多次时只发送一次
+                    symbol_queue.put((channel, l3_pkt, received))
+        finally:
+            print(f"Channel {channel}: received {received} symbols, new {len(self.symbols)}")
+            symbol_queue.put((channel, CHANNEL_DONE, received))
+            close_capture()
+
+    def input_from_channels(self, capture_method, regions, loopback=('auto_qrcode', 0, 0.0)):
+        '''K 个 channel 同时截屏解码，symbol 合并到同一个 wirehair 解码器'''
+        symbol_queue = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        workers = []
+        for channel, region in enumerate(regions):
+            process = multiprocessing.Process(target=self.capture_worker, args=(channel, capture_method, region, loopback, symbol_queue, stop))
+            process.start()
+            workers.append(process)
+        
+        channel_count = [0] * len(regions)
+        channel_received = [0] * len(regions)
+        progress = None
+        try:
+            while True:
+                try:
+                    channel, l3_pkt, channel_received[channel] = symbol_queue.get(timeout=1)
+                except Empty:
+                    # 截屏进程初始化失败（loopback 等待超时、截屏/解码依赖缺失等）时不再等待
+                    if not any(p.is_alive() for p in workers):
+                        print("All capture workers exited.")
+                        exit(1)
+                    continue
+                if l3_pkt is None:
+                    print("Multiple channels need fountain code.")
+                    exit(1)
+                if l3_pkt == CHANNEL_DONE:
+                    continue
+                idx, file_data_size, l3_pl, new = self.parse_l3_pkt_fountain_code(l3_pkt)
+                if progress is None:    # 第一次接收到数据
+                    tim = timer()
+                    l3_pl_size = len(l3_pkt) - 8
+                    num_chunks = (file_data_size + l3_pl_size - 1)// l3_pl_size
+                    progress = tqdm.tqdm(total=num_chunks, leave=True, mininterval=0.33)
+                if new:
+                    channel_count[channel] += 1
+                    progress.set_description(f"Idx: {idx} speed: {len(self.symbols)*l3_pl_size/max(tim.elapsed(), 1e-3):.2f} B/s")
+                    progress.update()
+                if l3_pl is not None:
+                    break
+            progress.close()
+        finally:
+            stop.set()
+            # 等待各 channel 的最终截取数，最后一个新 symbol 之后截取到的重复 symbol 也计入统计
+            done = set()
+            tim_stop = timer()
+            while len(done) < len(workers) and tim_stop.elapsed() < 5:
+                try:
+                    channel, l3_pkt, received = symbol_queue.get(timeout=0.5)
+                except Empty:
+                    if not any(p.is_alive() for p in workers):
+                        break
+                    continue
+                channel_received[channel] = max(channel_received[channel], received)
+                if l3_pkt == CHANNEL_DONE:
+                    done.add(channel)
+            for p in workers:
+                p.join(timeout=1)
+                if p.is_alive():
+                    p.terminate()
+        print(f"symbols per channel: {channel_count}")
+        self.symbols_received = sum(channel_received)   # 主进程只收到各 channel 去重后的 symbol
+        self.print_fountain_stats(num_chunks)
+        self.data_merged = l3_pl
+
+    def input_from_screen(self, capture_method, region='', win_title='', loopback=('auto_qrcode', 0, 0.0)):
+        capture_img, close_capture = self.open_capture(capture_method, region=region, win_title=win_title, loopback=loopback)
         
         # get first pkt
         tim = timer()
@@ -227,28 +409,33 @@ class Image2File:
                 progress.set_description(f"capture {1/elap:.3f}fps")
                 continue
             print(f"L3 mode: {'fountain code' if self.use_fountain_code else 'normal'}")
-            img.save("first.png") # write the first image to disk
+            (img if isinstance(img, Image.Image) else Image.fromarray(img)).save("first.png") # write the first image to disk
             progress.close()
             break
         
+        # 之后的截图交给进程池解码，codec 已在第一帧确定的配置（如 QR 后端）随 pickle 传给子进程
+        pool = multiprocessing.Pool(processes=self.nproc, initializer=init_worker, initargs=(self,)) if self.nproc > 1 else None
+        l3_pkts = self.iter_l3_pkt(capture_img, pool)
         if self.use_fountain_code:
             tim = timer()
-            collected_idx = set()
             idx = file_data_size = l3_pl_size = num_chunks = -1
             unrecv = True
             progress = tqdm.tqdm(leave=False, mininterval=0.33, bar_format='{desc}')
+            first_pkt = l3_pkt  # 第一帧也是有效的 symbol（systematic 优先时通常是第一个数据块）
             while True:
-                img = capture_img()
-                elap = tim.reset()
-                l3_pkt = self.get_l3_pkt_from_l2(img)
+                if first_pkt is not None:
+                    l3_pkt, first_pkt = first_pkt, None
+                    elap = tim.reset()
+                else:
+                    l3_pkt = next(l3_pkts)
+                    elap = tim.reset()
                 if l3_pkt is None: # 未接收到数据
-                    progress.set_description(f"speed: {len(collected_idx)*l3_pl_size/tim.since_init():.2f} B/s {1/elap:.3f}fps")
+                    progress.set_description(f"speed: {len(self.symbols)*l3_pl_size/tim.since_init():.2f} B/s {1/elap:.3f}fps")
                     continue
-                idx, file_data_size, l3_pl = self.parse_l3_pkt_fountain_code(l3_pkt)
-                if idx not in collected_idx:
-                    progress.set_description(f"Idx: {idx} speed: {len(collected_idx)*l3_pl_size/tim.since_init():.2f} B/s")
+                idx, file_data_size, l3_pl, new = self.parse_l3_pkt_fountain_code(l3_pkt)
+                if new:
+                    progress.set_description(f"Idx: {idx} speed: {len(self.symbols)*l3_pl_size/tim.since_init():.2f} B/s")
                     progress.update()
-                    collected_idx.add(idx)
                 if unrecv:  # 第一次接收到数据
                     unrecv = False
                     tim = timer()   # 重置时钟
@@ -260,6 +447,7 @@ class Image2File:
                     print()
                     break
             progress.close()
+            self.print_fountain_stats(num_chunks)
             self.data_merged = l3_pl
         else:
             num_chunks = remained = -1     # 总图片数
@@ -268,11 +456,10 @@ class Image2File:
             max_idx = -1
             tim = timer()
             while remained != 0:
-                img = capture_img()
+                l3_pkt = next(l3_pkts)
                 elap = tim.reset()
                 print(f"max: {max_idx:5d}{' ' if max_idx<= len(collected) else 'M'} len/tot: {len(collected):>5d}/{num_chunks:<5d} speed: {decoded_bytes/tim.since_init():.2f} B/s each iter: {elap:.2f}s speed: {1/elap:.3f}fps \r", end='')
                 
-                l3_pkt = self.get_l3_pkt_from_l2(img)
                 if l3_pkt is None:
                     continue
                 idx, num_chunks, data = self.parse_l3_pkt(l3_pkt)
@@ -292,16 +479,21 @@ class Image2File:
                     remained -= 1
             print()
             self.data_merged = b"".join([d for d in data_list])
-        if capture_method == 'dxcam':
-            camera.stop()
+        if pool is not None:
+            pool.terminate()
+        close_capture()
 
 if __name__ == "__main__":
     parser = get_parser()
     args = parser.parse_args()
     args.win_title = os.getenv('CAPTURE_WINDOW', args.win_title)
-    i2f = Image2File(nproc=args.nproc, method = args.method, qr_box_size=args.qr_box_size, qr_version=args.qr_version)
+    i2f = Image2File(nproc=args.nproc, method = args.method, qr_box_size=args.qr_box_size, qr_version=args.qr_version,
+                    pixel_bits=args.pixel_bits, qr_backend=args.qr_backend, batch_size=args.batch_size)
     i2f.convert(args.output,
                 mode=args.mode,
                 input_dir=args.input_dir,
-                region=args.region,
-                win_title=args.win_title)
+                regions=args.region,
+                win_title=args.win_title,
+                loopback_name=args.loopback_name,
+                capture_fps=args.capture_fps,
+                tear=args.tear)
@@ -4,18 +4,23 @@ import subprocess
 import multiprocessing
 import time
 import tqdm
-import base64
 import io
 import struct
 import math
-import qrcode.util
-import qrcode
-from PIL import Image, ImageTk
-import numpy as np
-import tkinter as tk
-from pixelbar import PixelBar
+from PIL import Image
+from codec import get_codec, codec_names
+from cache import FrameCache, frame_cache_key
 from util import *
-from pywirehair import encoder as wirehair_encoder
+
+_worker = None  # 进程池中每个进程一个 File2Image，codec 只初始化一次
+
+def init_worker(f2i):
+    global _worker
+    f2i.codec.reset()
+    _worker = f2i
+
+def mk_frames_worker(batch):
+    return _worker.mk_frames(batch)
 
 def get_parser():
     parser = argparse.ArgumentParser(
@@ -26,21 +31,22 @@ def get_parser():
     )
     parser.add_argument(
         "-m", "--mode",
-        default="screen", choices=['dir', 'video', 'screen'],
-        help="output to dir/video/screen(display in window)"
+        default="screen", choices=['dir', 'video', 'screen', 'loopback'],
+        help="output to dir/video/screen(display in window)/loopback(shared memory virtual screen, for testing)"
     )
     parser.add_argument(
         "-o", "--output-dir", default="./out", help="dir/video: output image/video directory"
     )
     parser.add_argument(
-        "-R", "--region", default="",
-        help="screen: display region, width:height:offset_left:offset_top. "
+        "-R", "--region", action="append",
+        help="screen/loopback: display region, width:height:offset_left:offset_top. "
+            "Repeat -R to display K windows (channels) fed with disjoint fountain code symbols. "
             "widht/height: int|d|w|h|f, 'd' means default 3/4*min(w,h). f: QR code fit pixel. "
             "Offset startwith '-' means from right/bottom, 'c' means center"
     )
     # L2
     parser.add_argument(
-        "-M", "--method", default="qrcode", choices=['qrcode', 'pixelbar', 'cimbar'], help="encoding method"
+        "-M", "--method", default="qrcode", choices=codec_names(), help="encoding method"
     )
     parser.add_argument(
         "-Q", "--qr-version", type=int, default=40, help="QRcode version"
@@ -48,82 +54,110 @@ def get_parser():
     parser.add_argument(
         "-B", "--qr-box-size", type=float, default=1.5, help="QRcode pixels=(21+4*version+2(border))*box_size, When use screen output, can be float. "
     )
+    parser.add_argument(
+        "--pixel-bits", type=int, default=8, choices=[8, 16], help="pixelbar: bits per box, 16 needs a clean colour channel or calibration frames"
+    )
+    parser.add_argument(
+        "--calib-interval", type=int, default=0, help="screen/loopback: show a colour calibration frame every N frames (pixelbar), 0 disables"
+    )
     # L3
     parser.add_argument(
         "-F", "--not-use-fountain-code", dest='use_fountain_code', action='store_false', help="l3 encoding method"
     )
+    parser.add_argument(
+        "--repair-ratio", type=float, default=0.25,
+        help="fountain code: each round sends all systematic symbols, then repair_ratio*num_chunks repair symbols. "
+            "<0: one round of systematic symbols, then repair symbols only"
+    )
     # misc
     parser.add_argument(
         "-n", "--nproc", type=int, default=-1, help="multiprocess encoding"
     )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=4, help="frames encoded per worker task"
+    )
+    parser.add_argument(
+        "--frame-bytes", type=int, default=0, help="bytes per frame, 0 means the codec capacity"
+    )
     parser.add_argument(
         "-f", "--fps", type=int, default=60, help="output screen display image fps"
     )
+    parser.add_argument(
+        "--loopback-name", default="auto_qrcode", help="loopback: shared memory name of the virtual screen"
+    )
+    parser.add_argument(
+        "--drop", type=float, default=0.0, help="loopback: probability of dropping a displayed frame"
+    )
+    parser.add_argument(
+        "-C", "--cache-dir", default="", help="rendered frame cache dir, reuse encoded frames when sending the same file again"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=1024, help="frame cache size limit in MB, least recently used files are evicted"
+    )
     
     return parser
 
 class File2Image:
-    def __init__(self, method='qrcode', nproc=1, qr_version=40, qr_box_size=1.5):
+    def __init__(self, method='qrcode', nproc=1, qr_version=40, qr_box_size=1.5, cache_dir='', cache_size=1024,
+                 pixel_bits=8, calib_interval=0, repair_ratio=0.25, batch_size=4, frame_bytes=0):
         if nproc <= 0:
             self.nproc = multiprocessing.cpu_count() - 1
         else:
             self.nproc = nproc
         self.method = method
         self.qr_version = qr_version
-        self.correction = qrcode.constants.ERROR_CORRECT_L
         self.qr_box_size = qr_box_size
         self.qr_border = 1
-        self.pb = PixelBar(self.qr_version, box_size=int(self.qr_box_size), border_size=self.qr_border, pixel_bits=8)
-        self.cb = None
-        
-    def encode_qrcode(self, data_):
-        # qrcode 实际编码二进制数据时，实际对数据有要求，需要满足ISO/IEC 8859-1
-        # 导致编码和解码后，得到错误数据，解决办法为使用base32编码（损耗6.25%）
-        # https://github.com/tplooker/binary-qrcode-tests/tree/master
-        data = base64.b32encode(data_)
-        qr = qrcode.QRCode(
-            version=self.qr_version,
-            error_correction=self.correction,
-            box_size=int(self.qr_box_size),   # in pixels
-            border=self.qr_border,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-        return img
-    
-    def encode_pixelbar(self, data):
-        return self.pb.encode(data)
+        self.pixel_bits = pixel_bits
+        self.calib_interval = calib_interval
+        self.repair_ratio = repair_ratio
+        self.batch_size = max(1, batch_size)
+        self.frame_bytes = frame_bytes
+        # 编码器只在第一次使用时导入依赖（qrcode/pycimbar 等）
+        self.codec = get_codec(method, qr_version=qr_version, qr_box_size=qr_box_size, qr_border=self.qr_border, pixel_bits=pixel_bits)
+        self.scaler = None  # screen 模式下由生产者直接缩放到窗口尺寸
+        self.scalers = []   # 每个窗口（channel）一个
+        self.window = 2 * self.nproc * self.batch_size  # 非喷泉码模式，同时在编码的帧数
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.cache = None
+        self.cache_frames = 0   # 缓存的帧 idx 上限，喷泉码的 symbol 无限产生，只缓存前面一部分
 
     def get_l2_pl_size(self):
-        if self.method == 'qrcode':
-            qr_maxbytes = qrcode.util.BIT_LIMIT_TABLE[self.correction][self.qr_version]//8
-            base32_valid = int(qr_maxbytes/1.0625/1.1)  # 理论计算结果超出限制，除以 1.1 简单修正一下
-            print(f"QR code version {self.qr_version} corr: L max bytes: {qr_maxbytes} base32_valid: {base32_valid}")
-            return base32_valid - 1
-        elif self.method == 'pixelbar':
-            return self.pb.max_data_size - 1
-        elif self.method == 'cimbar':
-            if not self.cb:
-                from pycimbar import cimbar
-                self.cb = cimbar.Cimbar()
-            return self.cb.get_capacity() - 1
-        else:
-            return 0
+        # 单帧大小在主进程确定一次，子进程直接使用 codec.capacity
+        return self.codec.negotiate_capacity(self.frame_bytes) - 1    # 1 byte l2_header
+
     def mk_l2_pkt(self, l3_pkt):
         l3_proto = 1 if self.use_fountain_code else 0  # 编码 L3 使用的协议
         l2_header = struct.pack("B", l3_proto)
-        l2_pkt = l2_header + l3_pkt
-        if self.method == 'qrcode':
-            img = self.encode_qrcode(l2_pkt)
-        elif self.method == 'pixelbar':
-            img = self.encode_pixelbar(l2_pkt)
-        elif self.method == 'cimbar':
-            return self.cb.encode_np(l2_pkt)
-        else:
+        return l2_header + l3_pkt
+
+    def mk_frames(self, batch):
+        '''[(idx, l3_pkt), ...] -> 最终输出的图像，screen 模式下已经是窗口尺寸，主线程只需转换显示
+        l3_pkt 可以是返回 bytes 的函数，缓存命中时不需要生成 l3_pkt，未命中的帧一起交给 codec.encode_batch
+        '''
+        frames = [self.cache.load(idx) if self.cache else None for idx, _ in batch]
+        miss = [i for i, arr in enumerate(frames) if arr is None]
+        if miss:
+            l2_pkts = [self.mk_l2_pkt(batch[i][1]() if callable(batch[i][1]) else batch[i][1]) for i in miss]
+            for i, arr in zip(miss, self.codec.encode_batch(l2_pkts)):
+                frames[i] = arr
+                idx = batch[i][0]
+                if self.cache and idx < self.cache_frames:
+                    self.cache.store(idx, arr)
+        if self.scaler is not None:
+            frames = [self.scaler.scale(arr) if arr is not None else None for arr in frames]
+        return frames
+
+    def get_calibration_frame(self, scaler=None):
+        '''颜色校准帧（仅 pixelbar），已缩放到窗口尺寸'''
+        if self.calib_interval <= 0:
             return None
-        return np.array(img)
+        scaler = scaler or self.scaler
+        calib = self.codec.calibration_frame()
+        if calib is not None and scaler is not None:
+            calib = scaler.scale(calib)
+        return calib
 
     def get_l3_pl_size(self, l2_pl_size):
         # if self.use_fountain_code:
@@ -136,23 +170,36 @@ class File2Image:
         header = struct.pack("II", idx, file_data_size)
         return header + data
         
-    def output_l2_pkt_to_queue(self, i, l3_pkt, result_queue):
-        # print(f'pid {os.getpid()}: chunk {i}')
-        result_queue.put(self.mk_l2_pkt(l3_pkt))
+    def iter_l3_pkt(self, file_data, l3_pl_size):
+        for i in range(self.num_chunks):
+            yield (i, self.mk_l3_pkt(i, self.num_chunks, file_data[i * l3_pl_size : (i + 1) * l3_pl_size]))
     
-    def output_l2_pkt_to_queue_fountain_code(self, pid, nproc, file_data, l3_pl_size, result_queue):
-        enc = wirehair_encoder(file_data, l3_pl_size)
-        i = pid # interleave 到每个进程
+    def output_l2_pkt_to_queue_fountain_code(self, pid, nproc, file_data, l3_pl_size, result_queue, scheduler, channel=0):
+        '''生产者 pid 负责发送顺序中的第 pid, pid+nproc... 批 symbol，每批 batch_size 帧，输出到自己的队列'''
+        from pywirehair import encoder as wirehair_encoder
+        self.codec.reset()  # fork 时继承了主进程查询容量时加载的后端，每个生产者使用自己的
+        if self.scalers:
+            self.scaler = self.scalers[channel]
+        enc = None  # 前面的 symbol 全部命中缓存时，不需要初始化 wirehair
+        def l3_pkt_fn(sym):
+            def mk_l3_pkt():
+                nonlocal enc
+                if enc is None:
+                    enc = wirehair_encoder(file_data, l3_pl_size)
+                return self.mk_l3_pkt_fountain_code(sym, len(file_data), enc.encode(sym))
+            return mk_l3_pkt
+        n = self.batch_size
+        block = pid # interleave 到每个进程
         while True:
-            while result_queue.qsize() > 240:
+            while result_queue.qsize() > max(2, 240 // (nproc * n)):
                 time.sleep(0.1)
             
-            l3_pl = enc.encode(i)
-            l3_pkt = self.mk_l3_pkt_fountain_code(i, len(file_data), l3_pl)
-            i += nproc
-            result_queue.put(self.mk_l2_pkt(l3_pkt))
+            syms = [scheduler.symbol(pos) for pos in range(block * n, (block + 1) * n)]
+            result_queue.put(self.mk_frames([(sym, l3_pkt_fn(sym)) for sym in syms]))
+            block += nproc
     
-    def convert(self, file_path, output_mode='screen', output_dir="", fps=10, region='', use_fountain_code=True):
+    def convert(self, file_path, output_mode='screen', output_dir="", fps=10, regions=None, use_fountain_code=True,
+                loopback_name='auto_qrcode', drop=0.0):
         self.use_fountain_code = use_fountain_code   # 不断产生新的编码块，直到解码成功
         with open(file_path, "rb") as f:
             file_data = f.read()
@@ -170,39 +217,74 @@ class File2Image:
             self.use_fountain_code = False
             print("Disable fountain code, because of single chunk.")
         
-        manager = multiprocessing.Manager()
-        result_queue = manager.Queue()
-
+        if self.cache_dir:
+            key = frame_cache_key(file_data, method=self.method, qr_version=self.qr_version, box_size=int(self.qr_box_size),
+                                  border=self.qr_border, pixel_bits=self.pixel_bits, l3_pl_size=l3_pl_size, fountain=int(self.use_fountain_code))
+            self.cache = FrameCache(self.cache_dir, key, max_bytes=self.cache_size << 20)
+            self.cache_frames = 2 * self.num_chunks if self.use_fountain_code else self.num_chunks
+            print(f"Frame cache: {self.cache.open()} cached frames in {self.cache.entry_dir}")
+        
+        regions = regions or ['']
+        if len(regions) > 1 and not (self.use_fountain_code and output_mode in ['screen', 'loopback']):
+            print("Multiple channels need fountain code and screen/loopback mode, use the first region only.")
+            regions = regions[:1]
+        if len(regions) > self.num_chunks:
+            print(f"More channels than chunks, use the first {self.num_chunks} regions only.")
+            regions = regions[:self.num_chunks]
+        channels = len(regions)
+        
+        # screen 模式先确定窗口尺寸，生产者直接输出该尺寸的图像
+        root = None
+        if output_mode == 'screen':
+            import tkinter as tk
+            root = tk.Tk()
+            display_regions = [self.get_display_region(r, root.winfo_screenwidth(), root.winfo_screenheight()) for r in regions]
+        elif output_mode == 'loopback':
+            from loopback import LOOPBACK_SCREEN
+            display_regions = [self.get_display_region(r, *LOOPBACK_SCREEN) for r in regions]
+        if output_mode in ['screen', 'loopback']:
+            self.scalers = [FrameScaler(width, height) for width, height, _, _ in display_regions]
+            self.scaler = self.scalers[0]
+        
         # 采用生产者和消费者模型，生产者输出 l2_pkt 到队列
-        # 主进程输出 l2_pkt 到文件/视频/屏幕
+        # 主进程输出 l2_pkt 到文件/视频/屏幕，每个 channel 一个队列
         if self.use_fountain_code:
+            manager = multiprocessing.Manager()
+            result_queues = []
             producers = []
-            # use one process now, TODO: use multiple processes encoding
-            for pid in range(self.nproc):
-                process = multiprocessing.Process(target=self.output_l2_pkt_to_queue_fountain_code, args=(pid, self.nproc, file_data, l3_pl_size, result_queue))
-                process.start()
-                producers.append(process)
+            nproc = max(1, self.nproc // channels)
+            print(f"Symbol schedule: {self.num_chunks} systematic + {'unlimited' if self.repair_ratio < 0 else math.ceil(self.repair_ratio * self.num_chunks)} repair symbols per round")
+            for channel in range(channels):
+                # 每个生产者一个队列，按发送顺序轮流读取，显示顺序与进程调度无关
+                scheduler = SymbolScheduler(self.num_chunks, self.repair_ratio, channel, channels)
+                queues = [manager.Queue() for _ in range(nproc)]
+                for pid in range(nproc):
+                    process = multiprocessing.Process(target=self.output_l2_pkt_to_queue_fountain_code,
+                                                      args=(pid, nproc, file_data, l3_pl_size, queues[pid], scheduler, channel))
+                    process.start()
+                    producers.append(process)
+                result_queues.append(RoundRobinQueue(queues))
         else:
-            pool = multiprocessing.Pool(processes=self.nproc)
-            # multiprocessing encoding
-            for i in range(self.num_chunks):
-                l3_pkt = self.mk_l3_pkt(i, self.num_chunks, file_data[i * l3_pl_size : (i + 1) * l3_pl_size])
-                pool.apply_async(self.output_l2_pkt_to_queue, (i, l3_pkt, result_queue))
-            pool.close()
+            pool = multiprocessing.Pool(processes=self.nproc, initializer=init_worker, initargs=(self,))
+            # multiprocessing encoding, 固定窗口内的帧按批并行编码，按 chunk 顺序输出
+            result_queues = [OrderedFrameQueue(pool, mk_frames_worker, self.iter_l3_pkt(file_data, l3_pl_size),
+                                               window=self.window, batch=self.batch_size)]
 
         try:
             if output_mode == 'dir':
                 if self.use_fountain_code:
                     print("Fountain code not support dir mode for now.")
                     exit(1)
-                self.output_file(result_queue, output_dir)
+                self.output_file(result_queues[0], output_dir)
             elif output_mode == 'video':
                 if self.use_fountain_code:
                     print("Fountain code not support video mode for now.")
                     exit(1)
-                self.output_video(result_queue, output_dir, fps=fps)
+                self.output_video(result_queues[0], output_dir, fps=fps)
             elif output_mode == 'screen':
-                self.output_screen(result_queue, fps=fps, region=region)
+                self.output_screen(result_queues, root, display_regions, fps=fps)
+            elif output_mode == 'loopback':
+                self.output_loopback(result_queues, display_regions, fps=fps, name=loopback_name, drop=drop)
             else:
                 raise ValueError(f"Invalid output mode: {output_mode}")
         except KeyboardInterrupt:
@@ -211,6 +293,8 @@ class File2Image:
             if self.use_fountain_code:
                 for p in producers:
                     p.terminate()  # 确保所有子进程被正确终止
+            else:
+                pool.terminate()
 
     def output_file(self, result_queue, output_dir):
         os.makedirs(output_dir, exist_ok=True)
@@ -228,58 +312,102 @@ class File2Image:
         png_to_video(output_dir, video_path, fps=fps)
         print(f"Output to {video_path}.")
 
-    def output_screen(self, result_queue, fps=1, region=''):
-        root = tk.Tk()
+    def get_display_region(self, region, mon_width, mon_height):
         fit_pixel = int((self.qr_version * 4 + 21 + 2*self.qr_border) * self.qr_box_size) # default 1.5, version 40 -> 275x275, can be distinguished
-        width, height, x, y = parse_region(region.split(':'), root.winfo_screenwidth(), root.winfo_screenheight(), fit_pixel=fit_pixel)
-        root.overrideredirect(True) # no window border (also no close button)
-        root.geometry(f'{width}x{height}+{x}+{y}')
-        root.attributes('-topmost', True)
-        label = tk.Label(root, borderwidth=0)   # no inner padding
-        label.pack(expand=True, fill=tk.BOTH)
-        print(f"Display in window[{root.winfo_screenwidth()}x{root.winfo_screenheight()}] {width}x{height}+{x}+{y} fps {fps}")
+        return parse_region(region.split(':'), mon_width, mon_height, fit_pixel=fit_pixel)
+
+    def output_loopback(self, result_queues, display_regions, fps=60, name='auto_qrcode', drop=0.0):
+        from loopback import LoopbackDisplay, channel_name
+        displays = []
+        for channel, (width, height, _, _) in enumerate(display_regions):
+            displays.append(LoopbackDisplay(channel_name(name, channel), width, height, fps=fps, drop=drop))
+            print(f"Display in loopback screen '{channel_name(name, channel)}' {width}x{height} fps {fps} drop {drop}")
+        calibs = [self.get_calibration_frame(scaler) for scaler in self.scalers]
+        try:
+            if self.use_fountain_code:
+                i = 0
+                progress = tqdm.tqdm(total=self.num_chunks, leave=True, mininterval=0.33, position=0)
+                while True:
+                    for display, result_queue, calib in zip(displays, result_queues, calibs):
+                        if calib is not None and i % self.calib_interval == 0:
+                            display.show(calib)
+                        else:
+                            display.show(result_queue.get())
+                            progress.update()
+                    i += 1
+            else:
+                display, result_queue, calib = displays[0], result_queues[0], calibs[0]
+                frames = []
+                for i in tqdm.tqdm(range(self.num_chunks)):
+                    frames.append(result_queue.get())
+                    display.show(frames[-1])
+                if calib is not None:
+                    frames.insert(0, calib)
+                i = 0
+                while True: # display repeatly
+                    display.show(frames[i])
+                    i = (i + 1) % len(frames)
+        finally:
+            for display in displays:
+                display.close()
+
+    def output_screen(self, result_queues, root, display_regions, fps=1):
+        import tkinter as tk
+        from PIL import ImageTk
+        # 第一个 channel 使用 root 窗口，其余 channel 各开一个 Toplevel 窗口
+        windows = [root] + [tk.Toplevel(root) for _ in display_regions[1:]]
+        labels = []
+        for win, (width, height, x, y) in zip(windows, display_regions):
+            win.overrideredirect(True) # no window border (also no close button)
+            win.geometry(f'{width}x{height}+{x}+{y}')
+            win.attributes('-topmost', True)
+            label = tk.Label(win, borderwidth=0)   # no inner padding
+            label.pack(expand=True, fill=tk.BOTH)
+            labels.append(label)
+            print(f"Display in window[{root.winfo_screenwidth()}x{root.winfo_screenheight()}] {width}x{height}+{x}+{y} fps {fps}")
         
         def quit_app(event):
             if event and event.char in ['q', 'Q', ' '] or\
                 (event.keysym == 'c' and event.state & 0x4):  # ctrl+c
                 root.destroy()
-        root.bind('<Key>', quit_app)
+        for win in windows:
+            win.bind('<Key>', quit_app)
         
         def update_image(label, img):
             label.configure(image=img)
             label.update()
         
+        calibs = [self.get_calibration_frame(scaler) for scaler in self.scalers]
         if self.use_fountain_code:
             tim = timer()
             i = 0
             progress = tqdm.tqdm(total=self.num_chunks, leave=True, mininterval=0.33, position=0)
             while True:
                 tim.reset()
-                image_ndarry = result_queue.get()
-                img = Image.fromarray(image_ndarry)
-                
-                # resize image, otherwise label window will be too big
-                img_resized = img.resize((width, height), Image.NEAREST)
-
-                progress.update()
-                img_tk = ImageTk.PhotoImage(img_resized)
+                img_tk_list = []
+                for result_queue, calib in zip(result_queues, calibs):
+                    if calib is not None and i % self.calib_interval == 0:
+                        image_ndarry = calib
+                    else:
+                        image_ndarry = result_queue.get()   # 生产者已缩放到窗口尺寸
+                        progress.update()
+                    img_tk_list.append(ImageTk.PhotoImage(Image.fromarray(image_ndarry)))
                 e = tim.elapsed()
                 if e < 1 / fps:
                     time.sleep(1 / fps - e)
-                update_image(label, img_tk)
+                for label, img_tk in zip(labels, img_tk_list):
+                    label.configure(image=img_tk)
+                    label.img = img_tk
+                root.update()
                 i += 1
         else:
+            label, result_queue, calib = labels[0], result_queues[0], calibs[0]
             img_tk_list = []
             tim = timer()
             for i in tqdm.tqdm(range(self.num_chunks)):
                 tim.reset()
-                image_ndarry = result_queue.get()
-                img = Image.fromarray(image_ndarry)
-                
-                # resize image, otherwise label window will be too big
-                img_resized = img.resize((width, height), Image.NEAREST)
-            
-                img_tk = ImageTk.PhotoImage(img_resized)
+                image_ndarry = result_queue.get()   # 生产者已缩放到窗口尺寸
+                img_tk = ImageTk.PhotoImage(Image.fromarray(image_ndarry))
                 if not self.use_fountain_code: img_tk_list.append(img_tk)
                 e = tim.elapsed()
                 if e < 1 / fps:
@@ -293,6 +421,8 @@ class File2Image:
                 next_index = (index + 1) % len(img_tk_list)
                 root.after(int(1000 / fps), update_image_timer, label, img_tk_list, next_index)
             
+            if calib is not None:
+                img_tk_list.insert(0, ImageTk.PhotoImage(Image.fromarray(calib)))
             # display repeatly
             update_image_timer(label, img_tk_list)
             try:
@@ -304,6 +434,9 @@ if __name__ == "__main__":
     parser = get_parser()
     args = parser.parse_args()
     f2i = File2Image(method=args.method, qr_version=args.qr_version, qr_box_size=args.qr_box_size,
-                     nproc=args.nproc)
+                     nproc=args.nproc, cache_dir=args.cache_dir, cache_size=args.cache_size,
+                     pixel_bits=args.pixel_bits, calib_interval=args.calib_interval, repair_ratio=args.repair_ratio,
+                     batch_size=args.batch_size, frame_bytes=args.frame_bytes)
     f2i.convert(args.input, output_mode=args.mode, use_fountain_code=args.use_fountain_code, 
-                output_dir=args.output_dir, region=args.region, fps=args.fps)
+                output_dir=args.output_dir, regions=args.region, fps=args.fps,
+                loopback_name=args.loopback_name, drop=args.drop)
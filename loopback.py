@@ -0,0 +1,152 @@
+'''
+回环传输：用共享内存模拟屏幕信道，无需两台机器或 Windows 即可端到端测试
+
+encoder 以 -m loopback 按 fps 把帧发布到共享内存（虚拟屏幕），
+decoder 以 -m loopback 按自己的速率截取，并可以注入信道损伤：
+    drop: 显示端丢帧概率（该帧从未出现在屏幕上）
+    tear: 截屏撕裂概率（上半部分为新帧，下半部分为旧帧）
+    capture fps: 截屏速率，与显示 fps 不一致时模拟重复/漏截
+'''
+import random
+import struct
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+LOOPBACK_SCREEN = (1920, 1080)  # 虚拟显示器尺寸，用于 parse_region
+HEADER_FMT = 'QIII'             # seq, height, width, channels
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+
+def channel_name(name, channel):
+    '''多个 channel 时每个 channel 一块虚拟屏幕'''
+    return name if channel == 0 else f'{name}.{channel}'
+
+def attach_shm(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)    # python>=3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # 避免 resource_tracker 在本进程退出时删除 encoder 创建的共享内存
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+class VirtualScreen:
+    '''单缓冲虚拟屏幕，seq 为奇数表示正在写入（seqlock）'''
+    def __init__(self, name='auto_qrcode', width=0, height=0, create=False):
+        self.name = name
+        self.create = create
+        if create:
+            self.width, self.height = width, height
+            size = HEADER_SIZE + width * height * 3
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError: # 上次异常退出残留，由本进程注册并删除（attach_shm 只用于不删除的读端）
+                old = shared_memory.SharedMemory(name=name)
+                old.close()
+                old.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.seq = 0
+            struct.pack_into(HEADER_FMT, self.shm.buf, 0, self.seq, height, width, 3)
+        else:
+            self.shm = attach_shm(name)
+            _, self.height, self.width, _ = struct.unpack_from(HEADER_FMT, self.shm.buf, 0)
+        self.frame = np.ndarray((self.height, self.width, 3), dtype=np.uint8, buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    @classmethod
+    def wait_attach(cls, name, timeout=60):
+        '''decoder 可能先于 encoder 启动'''
+        t0 = time.perf_counter()
+        while True:
+            try:
+                return cls(name)
+            except FileNotFoundError:
+                if time.perf_counter() - t0 > timeout:
+                    raise
+                time.sleep(0.1)
+
+    def publish(self, arr):
+        if arr.ndim == 2:
+            arr = arr[:, :, None]
+        self.seq += 1
+        struct.pack_into('Q', self.shm.buf, 0, self.seq)
+        self.frame[:] = arr
+        self.seq += 1
+        struct.pack_into('Q', self.shm.buf, 0, self.seq)
+
+    def read(self):
+        '''返回 (seq, frame)，保证读到完整的一帧'''
+        while True:
+            seq0 = struct.unpack_from('Q', self.shm.buf, 0)[0]
+            if seq0 % 2:
+                continue
+            frame = self.frame.copy()
+            if struct.unpack_from('Q', self.shm.buf, 0)[0] == seq0:
+                return seq0, frame
+
+    def close(self):
+        del self.frame
+        self.shm.close()
+        if self.create:
+            self.shm.unlink()
+
+class LoopbackDisplay:
+    '''encoder 端，按 fps 发布帧，以 drop 概率丢弃'''
+    def __init__(self, name, width, height, fps=60, drop=0.0, seed=None):
+        self.screen = VirtualScreen(name, width, height, create=True)
+        self.interval = 1 / fps
+        self.drop = drop
+        self.rng = random.Random(seed)
+        self.tim = None
+        self.shown = self.dropped = 0
+
+    def show(self, arr):
+        if self.tim is None:
+            from util import timer
+            self.tim = timer()
+        e = self.tim.elapsed()
+        if e < self.interval:
+            time.sleep(self.interval - e)
+        self.tim.reset()
+        if self.rng.random() < self.drop:
+            self.dropped += 1
+            return
+        self.screen.publish(arr)
+        self.shown += 1
+
+    def close(self):
+        print(f"Loopback display: shown {self.shown} dropped {self.dropped}")
+        self.screen.close()
+
+class LoopbackCapture:
+    '''decoder 端，按 fps 截取（0 不限速），以 tear 概率返回撕裂帧'''
+    def __init__(self, name, fps=0, tear=0.0, seed=None, timeout=60):
+        self.screen = VirtualScreen.wait_attach(name, timeout=timeout)
+        self.interval = 1 / fps if fps > 0 else 0
+        self.tear = tear
+        self.rng = random.Random(seed)
+        self.last = None
+        self.t_last = 0
+        self.captured = self.torn = 0
+
+    def capture(self):
+        if self.interval:
+            e = time.perf_counter() - self.t_last
+            if e < self.interval:
+                time.sleep(self.interval - e)
+            self.t_last = time.perf_counter()
+        _, frame = self.screen.read()
+        self.captured += 1
+        if self.last is not None and self.rng.random() < self.tear:
+            split = self.rng.randrange(1, frame.shape[0])
+            torn = frame.copy()
+            torn[split:] = self.last[split:]
+            self.last = frame
+            self.torn += 1
+            return torn
+        self.last = frame
+        return frame
+
+    def close(self):
+        print(f"Loopback capture: captured {self.captured} torn {self.torn}")
+        self.screen.close()
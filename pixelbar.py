@@ -1,7 +1,32 @@
 import struct
+import zlib
 import numpy as np
 from PIL import Image
 
+# 每个通道的电平，mode 1: 3-3-2（有效位后紧随 1 位设置为 1，电平落在区间中间），mode 2: 5-6-5
+LEVELS = {
+    1: ([(k << 5) | 0x10 for k in range(8)], [(k << 5) | 0x10 for k in range(8)], [(k << 6) | 0x20 for k in range(4)]),
+    2: ([k << 3 for k in range(32)], [k << 2 for k in range(64)], [k << 3 for k in range(32)]),
+}
+# 边框颜色（黄、红、绿、蓝），最后一列用于拟合偏移
+BORDER_REF = np.array([[255, 255, 0, 1], [255, 0, 0, 1], [0, 255, 0, 1], [0, 0, 255, 1]], dtype=np.float64)
+CALIB_MAGIC = 0xFFFFFFFF
+COLOR_MARGIN = 64   # 识别边框颜色时，主通道需要比其它通道高出的值
+TRANSITION_DIFF = 24    # 相邻像素任一通道差值超过该值，认为是 box 边界
+
+SCRAMBLE_SEED = 0x5eed
+
+_prbs = np.zeros(0, dtype=np.uint8)
+def scramble(data):
+    """与固定的伪随机序列异或（加扰/解扰相同），连续相同的字节（如文件中的 0）也会产生颜色跳变
+    使用 bit generator 的原始输出，不同 numpy 版本之间保持一致
+    """
+    global _prbs
+    n = len(data)
+    if len(_prbs) < n:
+        _prbs = np.random.PCG64(SCRAMBLE_SEED).random_raw((n + 7) // 8).view(np.uint8)
+    return (np.frombuffer(bytes(data), dtype=np.uint8) ^ _prbs[:n]).tobytes()
+
 class PixelBar:
     def __init__(self, version=40, box_size=1, border_size=1, pixel_bits=8):
         box = 21 + 4*version + 2*border_size
@@ -16,159 +41,251 @@ class PixelBar:
 
         self.pixel_bits = pixel_bits # 8 or 16
         self.mode = 1 if pixel_bits == 8 else 2
-        self.max_data_size = self.width_data_box * self.height_data_box * self.mode - 4
-
-    def _mode1_encode(self, data):
-        """3-3-2 编码模式"""
-        pixels = []
-        for byte in data:
-            r = (byte >> 5) & 0x07   # 高3位
-            g = (byte >> 2) & 0x07   # 中3位
-            b = byte & 0x03          # 低2位
-            
-            # 使用每个通道的高位保存数据（不容易失真）
-            r = (r << 5) | 0x10  # 在有效位后紧随 1 位设置为 1，防止像素向下偏移或者向上偏移，影响高位
-            g = (g << 5) | 0x10
-            b = (b << 6) | 0x20
-            pixels.append((r, g, b))
-        return pixels
-
-    def _mode2_encode(self, data):
-        """5-(3,3)-5 编码模式"""
-        pixels = []
+        self.max_data_size = self.width_data_box * self.height_data_box * self.mode - 8
+        self.calib_levels = {}  # mode -> 校准帧测得的各通道电平
+        self.grid_cache = {}    # 边框位置 -> box 中心坐标
+
+    def _mode1_symbols(self, data):
+        """3-3-2 编码模式，每个 box 1 byte，返回每个通道的电平序号"""
+        v = np.frombuffer(bytes(data), dtype=np.uint8).astype(np.intp)
+        return np.stack([(v >> 5) & 0x07,   # 高3位
+                         (v >> 2) & 0x07,   # 中3位
+                         v & 0x03], axis=1) # 低2位
+
+    def _mode2_symbols(self, data):
+        """5-6-5 编码模式，每个 box 2 byte"""
         if len(data) % 2 != 0:
             data += b'\x00'  # 补零处理
-        for i in range(0, len(data), 2):
-            word = (data[i] << 8) | data[i+1]
-            
-            r = (word >> 11) & 0x1F   # 高5位
-            g = (word >> 5)  & 0x3F   # 中6位
-            b = word & 0x1F           # 低5位
-            
-            r = (r << 3)
-            g = (g << 2)
-            b = (b << 3)
-            pixels.append((r, g, b))
-        return pixels
+        word = np.frombuffer(bytes(data), dtype='>u2').astype(np.intp)
+        return np.stack([(word >> 11) & 0x1F,   # 高5位
+                         (word >> 5)  & 0x3F,   # 中6位
+                         word & 0x1F], axis=1)  # 低5位
 
-    def encode(self, data_):
-        # 数据长度校验
-        if len(data_) > self.max_data_size:
-            raise ValueError(f"pixelbar version {self.version} mode {self.mode}, max {self.max_data_size} bytes, get {len(data_)} bytes")
-        
-        data = struct.pack('I', len(data_)) + data_
-        # 选择编码模式
+    def _symbols(self, data):
         if self.mode == 1:
-            pixels = self._mode1_encode(data)
+            return self._mode1_symbols(data)
         elif self.mode == 2:
-            pixels = self._mode2_encode(data)
-        else:
-            raise ValueError("unsupported pixelbar mode")
+            return self._mode2_symbols(data)
+        raise ValueError("unsupported pixelbar mode")
 
-        # 生成图像矩阵
+    def _render(self, symbols):
+        """电平序号 -> 图像，未使用的 box 为白色"""
+        levels = LEVELS[self.mode]
         B, b, w, h = self.box_size, self.border_size, self.width_data_box, self.height_data_box
-        # arr = np.zeros((self.height+2*b, self.width+2*b, 3), dtype=np.uint8)
+        boxes = np.full((h * w, 3), 255, dtype=np.uint8)
+        n = min(len(symbols), h * w)
+        for ch in range(3):
+            boxes[:n, ch] = np.asarray(levels[ch], dtype=np.uint8)[symbols[:n, ch]]
+        data_area = np.repeat(np.repeat(boxes.reshape(h, w, 3), B, axis=0), B, axis=1)
+
+        # 生成图像矩阵
         arr = np.full(((h+2*b)*B, (w+2*b)*B, 3), 255, dtype=np.uint8)
+        arr[B*b:(h+b)*B, B*b:(w+b)*B] = data_area
         arr[:B*b, :]    = (255, 255, 0)
         arr[:, -B*b:]   = (255, 0, 0)
         arr[-B*b:, :]   = (0, 255, 0)
         arr[B*b:, :B*b] = (0, 0, 255)  # 跳过左上角
+        return Image.fromarray(arr)
+
+    def encode(self, data_):
+        # 数据长度校验
+        if len(data_) > self.max_data_size:
+            raise ValueError(f"pixelbar version {self.version} mode {self.mode}, max {self.max_data_size} bytes, get {len(data_)} bytes")
         
-        for p in range(len(pixels)):
-            y, x = divmod(p, w)
-            if y < h:
-                # for i in range(B):
-                #     for j in range(B):
-                #         arr[y*B+i, x*B+j] = pixels[p]
-                arr[(y+b)*B:(y+1+b)*B, (x+b)*B:(x+1+b)*B] = pixels[p]
-        
-        img = Image.fromarray(arr)
-        # return img.resize((self.width, self.height), Image.NEAREST)
-        return img
-
-    def decode(self, img, box_size=None, mode=1):
-        border_size = 1
-        width, height = img.size
-        # img = img.resize((width//box_size, height//box_size), Image.NEAREST)
-        arr = np.array(img)
+        # 长度 + crc32，颜色失真导致的错误帧直接丢弃，而不是输出错误数据
+        data = struct.pack('II', len(data_), zlib.crc32(data_)) + data_
+        # 未使用的 box 也填满，加扰后每帧都有足够的颜色跳变用于估计网格
+        data += bytes(self.width_data_box * self.height_data_box * self.mode - len(data))
+        return self._render(self._symbols(scramble(data)))
+
+    def encode_calibration(self):
+        """颜色校准帧：header 长度为 CALIB_MAGIC，之后每个 box 的电平按固定规律遍历所有电平"""
+        # header 不加扰，全部为最高电平，未校准时也能可靠识别
+        header = self._symbols(struct.pack('II', CALIB_MAGIC, 0))
+        return self._render(np.concatenate([header, self._calibration_symbols(self.width_data_box * self.height_data_box - len(header))]))
+
+    def _calibration_symbols(self, n):
+        j = np.arange(n)
+        # 各通道步长与电平数互质，保证每个通道的每个电平都出现，且与其它通道的组合不固定
+        return np.stack([(j * step) % len(lv) for step, lv in zip((1, 7, 13), LEVELS[self.mode])], axis=1)
+
+    def _fit_color_correction(self, bands):
+        """用四条边框（黄/红/绿/蓝）拟合 measured = true @ A + c，返回 (A^-1, c)
+        边框不均匀或者颜色偏差过大时，认为没有图像，返回 None
+        """
+        measured = []
+        for band in bands:
+            band = band.astype(np.float32)
+            if len(band) == 0 or band.std(axis=0).max() > 40:
+                return None
+            measured.append(band.mean(axis=0))
+        X = np.linalg.solve(BORDER_REF, np.array(measured))
+        A, offset = X[:3], X[3]
+        off_diag = A[~np.eye(3, dtype=bool)]
+        if A.diagonal().min() < 0.35 or np.abs(off_diag).max() > 0.25:
+            return None
+        return np.linalg.inv(A), offset
+
+    @staticmethod
+    def _band_edges(lines, head, tail):
+        """在若干条扫描线上找边框：head 色带起点，tail 色带终点（不包含），以及两条色带的宽度
+        返回 (start, end, band_width, transitions, num_lines)，transitions 为各扫描线上颜色跳变相对 start 的位置
+        """
+        edges, transitions = [], []
+        for line in lines:
+            line = line.astype(np.int16)
+            is_head, is_tail = head(line), tail(line)
+            if not is_head.any() or not is_tail.any():
+                continue
+            start = np.flatnonzero(is_head)[0]
+            head_end = start + np.argmin(is_head[start:]) if not is_head[start:].all() else len(line)
+            end = np.flatnonzero(is_tail)[-1] + 1
+            rev = is_tail[:end][::-1]
+            tail_start = end - np.argmin(rev) if not rev.all() else 0
+            if end - start < 3:
+                continue
+            edges.append((start, end, head_end - start, end - tail_start))
+            jump = np.abs(np.diff(line[start:end], axis=0)).max(axis=1) > TRANSITION_DIFF
+            transitions.append(np.flatnonzero(jump) + 1)
+        if len(edges) < len(lines) // 2 + 1:
+            return None
+        start, end, head_width, tail_width = np.median(np.array(edges), axis=0)
+        return int(start), int(end), (head_width + tail_width) / 2, np.concatenate(transitions), len(edges)
+
+    @staticmethod
+    def _fit_pitch(total, band_width, transitions, num_lines):
+        """box 个数 n：最近邻缩放下 box k 的第一个像素为 ceil(k*total/n - 0.5)，
+        与各扫描线上实际颜色跳变的位置比较（交集/并集），取最吻合的 n
+        色带宽度只能给出粗略范围（缩放后宽度会取整），用于限定搜索范围
+        """
+        n_lo = max(3, int(total / (band_width + 1.5)))
+        n_hi = min(total, int(total / max(band_width - 1.5, 1)) + 1)
+        if len(transitions) == 0 or n_lo > n_hi:
+            return int(round(total / band_width))
+        hist = np.bincount(transitions[transitions < total], minlength=total)
+        best_n, best_score = None, 0
+        for n in range(n_lo, n_hi + 1):
+            k = np.arange(1, n)
+            predicted = (2 * k * total - n + 2 * n - 1) // (2 * n)
+            inter = hist[predicted].sum()
+            score = inter / (num_lines * len(predicted) + hist.sum() - inter)
+            if score > best_score:
+                best_n, best_score = n, score
+        return best_n if best_score > 0.3 else None
+
+    def _estimate_grid(self, arr, lines=9):
+        """根据边框位置和颜色跳变估计 box 网格（亚像素），返回每一列/行 box 中心的像素坐标
+        窗口缩放比例不是整数时（如 -B 1.5），box 间距为小数，不能按整数 box_size 采样
+        """
+        height, width = arr.shape[:2]
+        m = COLOR_MARGIN
+        def is_yellow(p): return (p[:, 0] - p[:, 2] > m) & (p[:, 1] - p[:, 2] > m)
+        def is_red(p):    return (p[:, 0] - p[:, 1] > m) & (p[:, 0] - p[:, 2] > m)
+        def is_green(p):  return (p[:, 1] - p[:, 0] > m) & (p[:, 1] - p[:, 2] > m)
+        def is_blue(p):   return (p[:, 2] - p[:, 0] > m) & (p[:, 2] - p[:, 1] > m)
+        # 在中间一半区域取多条扫描线，水平方向左蓝右红，垂直方向上黄下绿
+        rows = np.linspace(height // 4, height * 3 // 4, lines).astype(int)
+        cols = np.linspace(width // 4, width * 3 // 4, lines).astype(int)
+        edges_x = self._band_edges([arr[y] for y in rows], is_blue, is_red)
+        edges_y = self._band_edges([arr[:, x] for x in cols], is_yellow, is_green)
+        if edges_x is None or edges_y is None:
+            return None
+        # 帧位置不变时沿用上次的网格，省去 pitch 搜索
+        key = (edges_x[:2], edges_y[:2])
+        if key in self.grid_cache:
+            return self.grid_cache[key]
+        centers = []
+        for start, end, band_width, transitions, num_lines in (edges_x, edges_y):
+            n = self._fit_pitch(end - start, band_width, transitions, num_lines)
+            if n is None or n < 3:
+                return None
+            pitch = (end - start) / n
+            # 最近邻缩放下第 k 个 box 覆盖 [start + k*pitch - 0.5, start + (k+1)*pitch - 0.5)
+            centers.append(np.floor(start + (np.arange(n) + 0.5) * pitch).astype(np.intp))
+        if len(self.grid_cache) > 16:
+            self.grid_cache.clear()
+        self.grid_cache[key] = centers
+        return centers
+
+    def _quantize(self, samples, mode):
+        """最近电平量化，优先使用校准帧得到的电平"""
+        levels = self.calib_levels.get(mode) or LEVELS[mode]
+        symbols = np.empty(samples.shape, dtype=np.intp)
+        for ch in range(3):
+            lv = np.asarray(levels[ch], dtype=np.float32)
+            symbols[:, ch] = np.searchsorted((lv[1:] + lv[:-1]) / 2, samples[:, ch])
+        return symbols
+
+    def _calibrate(self, samples, mode, header_boxes):
+        """根据校准帧更新每个通道各电平的实际位置（已做边框颜色校正后的值）"""
+        samples = samples[header_boxes:]
+        expected = self._calibration_symbols(len(samples))
+        calib = []
+        for ch, lv in enumerate(LEVELS[mode]):
+            groups = [samples[expected[:, ch] == k, ch] for k in range(len(lv))]
+            centers = np.array([g.mean() for g in groups])
+            spread = max(g.std() for g in groups)
+            # 电平不单调，或者同一电平的采样过于分散（如撕裂帧），校准无效
+            if not np.all(np.diff(centers) > 2 * spread):
+                return
+            calib.append(centers)
+        self.calib_levels[mode] = calib
+        print(f"pixelbar mode {mode} calibrated")
+
+    def decode(self, img, box_size=None, mode=None):
+        mode = mode or self.mode
+        arr = np.asarray(img)   # 支持 PIL.Image 或 ndarray
+        if arr.ndim != 3 or arr.shape[2] < 3:
+            return None
+        arr = arr[:, :, :3]
+        height, width = arr.shape[:2]
         
-        # detect box size
-        # TODO: 检测效果不行，需要改进
-        def pixels_are_equal(pixel1, pixel2, rtol=10, atol=10):
-            return np.allclose(pixel1, pixel2, rtol=rtol, atol=atol)
-        def gcd(a, b):
-            while b:
-                a, b = b, a % b
-            return a
-        if not box_size:
-            count = {}
-            for i in range(0, height, height//3):
-                j = 0
-                while j < width-1:
-                    k = j
-                    while k+1 < width and pixels_are_equal(arr[i, k], arr[i, k+1]):
-                        k += 1
-                    count[k-j+1] = count.get(k-j+1, 0) + 1
-                    j = k + 1
-            sorted_count = sorted(count.items(), key=lambda x: x[1], reverse=True)
-            if len(sorted_count) < 3:
-                box_size = sorted_count[0][0]
-            else:
-                box_size = gcd(sorted_count[2][0], gcd(sorted_count[0][0], sorted_count[1][0]))
-            
-        B = box_size
-        b = border_size
-        # 检查是否有图像
-        # 通过检查边框是否全为白色来判断
-        # TODO: QR Code 的四个角的检测逻辑
-        p_a = np.mean(arr[:B*b, :]      , axis=(0, 1))
-        p_b = np.mean(arr[:, -B*b:]     , axis=(0, 1))
-        p_c = np.mean(arr[-B*b:, :]    , axis=(0, 1))
-        p_d = np.mean(arr[B*b:, :B*b]   , axis=(0, 1))
-        if not (p_a[0] > 200 and p_a[1] > 200 and p_a[2] < 50) or \
-           not (p_b[0] > 200 and p_b[1] < 50 and p_b[2] < 50) or \
-           not (p_c[0] < 50 and p_c[1] > 200 and p_c[2] < 50) or \
-           not (p_d[0] < 50 and p_d[1] < 50 and p_d[2] > 200):
+        # 从边框估计网格，失败时按给定的整数 box_size 采样
+        grid = self._estimate_grid(arr)
+        if grid is not None:
+            xs, ys = grid
+        elif box_size:
+            B = int(box_size)
+            xs = np.arange(width // B) * B + B // 2
+            ys = np.arange(height // B) * B + B // 2
+        else:
+            return None
+        if len(xs) < 3 or len(ys) < 3:
+            return None
+        # 检查是否有图像，并用边框的已知颜色校正 gamma/色彩配置带来的偏差（border_size 固定为 1）
+        bands = [arr[ys[0], xs[1:-1]], arr[ys[1:-1], xs[-1]], arr[ys[-1], xs[1:-1]], arr[ys[1:-1], xs[0]]]
+        correction = self._fit_color_correction(bands)
+        if correction is None:
             return None
+        A_inv, offset = correction
         
-        w, h = img.size
-        w, h = w//B, h//B
-        width_data_box, height_data_box = w - 2*b, h - 2*b
-        # print(f"box size: {B}, border size: {b}, data box size: {width_data_box}x{height_data_box}")
-        pixels = []
-        for y in range(height_data_box):
-            for x in range(width_data_box):
-                pixels.append(arr[(y + b)*B + B//2, (x + b)*B + B//2])
+        samples = arr[ys[1:-1, None], xs[None, 1:-1]].reshape(-1, 3).astype(np.float32)
+        samples = (samples - offset) @ A_inv
+        symbols = self._quantize(samples, mode)
 
         # 选择编码模式
         if mode == 1:
-            data = self._mode1_decode(pixels)
+            data = self._mode1_decode(symbols)
         elif mode == 2:
-            data = self._mode2_decode(pixels)
+            data = self._mode2_decode(symbols)
         else:
             raise ValueError("不支持的编码模式")
-        length = struct.unpack('I', bytes(data[:4]))[0]
-        data = data[4:4+length]
-        return bytes(data)
-    
-    def _mode1_decode(self, pixels):
-        data = []
-        for r, g, b in pixels:
-            r = (r >> 5) & 0x07 # byte 高3位
-            g = (g >> 5) & 0x07 # byte 中3位
-            b = (b >> 6) & 0x03 # byte 低2位
-            data.append((r << 5) | (g << 2) | b)
-        return data
-    def _mode2_decode(self, pixels):
-        data = []
-        for r, g, b in pixels:
-            r = (r >> 3) & 0x1F # byte1 高5位
-            g = (g >> 2) & 0x3F # byte1 低3位, byte2 高3位
-            g1, g2 = g >> 3, g & 0x07
-            b = (b >> 3) & 0x1F # byte2 低5位
-            data.append((r << 3) | g1)
-            data.append((g2 <<5) | b)
+        if struct.unpack('I', data[:4])[0] == CALIB_MAGIC:
+            self._calibrate(samples, mode, header_boxes=8 // mode)
+            return None
+        data = scramble(data)
+        length, crc = struct.unpack('II', data[:8])
+        data = data[8:8+length]
+        if len(data) != length or zlib.crc32(data) != crc:
+            return None
         return data
+    
+    def _mode1_decode(self, symbols):
+        r, g, b = symbols[:, 0], symbols[:, 1], symbols[:, 2]
+        return ((r << 5) | (g << 2) | b).astype(np.uint8).tobytes()
+    def _mode2_decode(self, symbols):
+        r, g, b = symbols[:, 0], symbols[:, 1], symbols[:, 2]
+        return ((r << 11) | (g << 5) | b).astype('>u2').tobytes()
 
 if __name__ == "__main__":
     import argparse
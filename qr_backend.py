@@ -0,0 +1,114 @@
+'''
+QR 解码后端：pyzbar（只扫描 QR）、opencv QRCodeDetector、zxing-cpp
+
+每个后端为 decode(gray) -> bytes 或 None，输入为 uint8 灰度 ndarray，输出为 QR 中的原始数据。
+依赖在第一次使用时导入，未安装的后端 load_backend 抛出 ImportError。
+'''
+import numpy as np
+
+_BACKENDS = {}
+
+def register_backend(name):
+    def wrap(loader):
+        _BACKENDS[name] = loader
+        return loader
+    return wrap
+
+def backend_names():
+    return list(_BACKENDS)
+
+def load_backend(name):
+    if name not in _BACKENDS:
+        raise ValueError(f"Invalid QR backend: {name}, choices: {backend_names()}")
+    return _BACKENDS[name]()
+
+def available_backends():
+    backends = {}
+    for name in _BACKENDS:
+        try:
+            backends[name] = load_backend(name)
+        except ImportError:
+            pass
+    return backends
+
+def to_gray(img):
+    '''PIL.Image/RGB/bool ndarray -> uint8 灰度图，所有后端都用同一种输入'''
+    arr = np.asarray(img)
+    if arr.dtype == bool:
+        return arr.astype(np.uint8) * 255
+    if arr.ndim == 3:
+        # 二维码只有黑白，取单个通道即可，避免整幅图的颜色转换
+        return np.ascontiguousarray(arr[:, :, 1])
+    return arr
+
+@register_backend('pyzbar')
+def load_pyzbar():
+    from pyzbar.pyzbar import decode, ZBarSymbol
+    def decode_pyzbar(gray):
+        decoded = decode(gray, symbols=[ZBarSymbol.QRCODE])   # 只扫描 QR，跳过其它码制
+        return decoded[0].data if decoded else None
+    return decode_pyzbar
+
+@register_backend('opencv')
+def load_opencv():
+    import cv2
+    detector = cv2.QRCodeDetector()
+    def decode_opencv(gray):
+        data, points, _ = detector.detectAndDecode(gray)
+        if points is None or not data:
+            return None
+        return data.encode('latin-1')
+    return decode_opencv
+
+@register_backend('zxing')
+def load_zxing():
+    import zxingcpp
+    def decode_zxing(gray):
+        decoded = zxingcpp.read_barcodes(gray, formats=zxingcpp.BarcodeFormat.QRCode)
+        return decoded[0].bytes if decoded else None
+    return decode_zxing
+
+def benchmark(backends, gray, rounds=3, check=None):
+    '''返回 {name: (每帧耗时, 解码结果)}，check(data) 为 False 的结果视为 None'''
+    from util import timer
+    result = {}
+    for name, decode in backends.items():
+        tim = timer()
+        data = None
+        for _ in range(rounds):
+            data = decode(gray)
+        elapsed = tim.elapsed() / rounds
+        if data is not None and check is not None and not check(data):
+            data = None
+        result[name] = (elapsed, data)
+    return result
+
+def pick_fastest(backends, gray, rounds=3, check=None):
+    '''在同一帧上测试所有后端，返回 (最快且结果正确的后端名, 解码结果, benchmark 结果)
+    结果以多数后端一致的数据为准，都解不出时返回 (None, None, ...)
+    '''
+    result = benchmark(backends, gray, rounds=rounds, check=check)
+    outputs = [data for _, data in result.values() if data is not None]
+    if not outputs:
+        return None, None, result
+    expected = max(set(outputs), key=outputs.count)
+    name = min((n for n, (_, data) in result.items() if data == expected), key=lambda n: result[n][0])
+    return name, expected, result
+
+if __name__ == "__main__":
+    # 在一张截图上对比各后端：python qr_backend.py -i first.png -N 20
+    import argparse
+    from PIL import Image
+    parser = argparse.ArgumentParser(description="Benchmark QR decoder backends.")
+    parser.add_argument("-i", "--input", default="first.png", help="image containing a QR code, e.g. first.png saved by decoder.py")
+    parser.add_argument("-N", "--rounds", type=int, default=20, help="decode rounds per backend")
+    args = parser.parse_args()
+
+    backends = available_backends()
+    missing = [n for n in backend_names() if n not in backends]
+    if missing:
+        print(f"unavailable: {', '.join(missing)}")
+    gray = to_gray(Image.open(args.input))
+    name, _, result = pick_fastest(backends, gray, rounds=args.rounds)
+    for n, (elapsed, data) in sorted(result.items(), key=lambda x: x[1][0]):
+        print(f"{n:>8s}: {elapsed*1000:.2f} ms/frame {'ok' if data is not None else 'failed'}{' <- fastest' if n == name else ''}")
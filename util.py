@@ -1,8 +1,11 @@
 import hashlib
 import subprocess
+import math
 import time
 import os
+from collections import deque
 from PIL import Image
+import numpy as np
 
 # Function to compute MD5 hash of a file
 def md5sum(file_path):
@@ -30,6 +33,137 @@ class timer():
         return self.t0 - self.t0_init
 
 # Encoder
+class FrameScaler:
+    '''最近邻缩放到固定的显示尺寸，索引表按输入尺寸缓存
+    采样位置与 PIL Image.NEAREST 一致（像素中心），整数倍时退化为 box 复制
+    '''
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.index_map = {}
+
+    def _get_index(self, src_h, src_w):
+        key = (src_h, src_w)
+        if key not in self.index_map:
+            ys = ((np.arange(self.height) + 0.5) * src_h / self.height).astype(np.intp)
+            xs = ((np.arange(self.width) + 0.5) * src_w / self.width).astype(np.intp)
+            self.index_map[key] = (np.minimum(ys, src_h - 1)[:, None], np.minimum(xs, src_w - 1)[None, :])
+        return self.index_map[key]
+
+    def scale(self, arr):
+        if arr.dtype == bool:   # qrcode 输出为 1 bit 图像，转为 L 模式，Tk 端无需再转换
+            arr = arr.astype(np.uint8) * 255
+        src_h, src_w = arr.shape[:2]
+        if (src_h, src_w) == (self.height, self.width):
+            return arr
+        if self.height % src_h == 0 and self.width % src_w == 0 and self.height // src_h == self.width // src_w:
+            k = self.height // src_h
+            return np.repeat(np.repeat(arr, k, axis=0), k, axis=1)
+        ys, xs = self._get_index(src_h, src_w)
+        return arr[ys, xs]
+
+class OrderedFrameQueue:
+    '''有序的有界流水线：最多 window 个任务在进程池中执行，get() 按提交顺序返回结果
+    消费者取走一个结果才提交下一个任务，内存占用与文件大小无关
+    每个任务为 func([args, ...]) -> [result, ...]，最多 batch 个 args，window 按帧数计算
+    '''
+    def __init__(self, pool, func, args_iter, window=8, batch=1):
+        self.pool = pool
+        self.func = func
+        self.args_iter = iter(args_iter)
+        self.batch = max(1, batch)
+        self.window = max(1, window // self.batch)
+        self.pending = deque()
+        self.ready = deque()
+        self._fill()
+
+    def _fill(self):
+        while len(self.pending) < self.window:
+            batch = [args for _, args in zip(range(self.batch), self.args_iter)]
+            if not batch:
+                break
+            self.pending.append(self.pool.apply_async(self.func, (batch,)))
+
+    def get(self):
+        if self.ready:
+            return self.ready.popleft()
+        if not self.pending:
+            raise IndexError("OrderedFrameQueue is exhausted")
+        result = self.pending.popleft().get()
+        self._fill()
+        self.ready.extend(result)
+        return self.ready.popleft()
+
+class SymbolScheduler:
+    '''喷泉码 symbol 发送顺序：每轮先发送全部 systematic symbol（id < num_chunks，即原始数据块），
+    再发送 repair_ratio * num_chunks 个新的 repair symbol，然后开始下一轮。
+    信道干净时接收端收齐一轮 systematic symbol 即可完成，几乎不需要求解；丢帧时由 repair symbol 补齐，
+    中途加入的接收端在下一轮补上缺少的 systematic symbol。repair_ratio < 0 表示只发送一轮 systematic，之后全部为 repair。
+    多 channel 时 channel c 只发送 id % channels == c 的 systematic/repair symbol，各 channel 互不重复。
+    symbol(pos) 只依赖 pos，各生产者进程可以独立计算，输出顺序与进程数无关。
+    '''
+    def __init__(self, num_chunks, repair_ratio=0.25, channel=0, channels=1):
+        self.num_chunks = num_chunks
+        self.channel = channel
+        self.channels = channels
+        self.num_systematic = len(range(channel, num_chunks, channels))
+        if repair_ratio < 0:
+            self.repair_per_round = self.num_repair = -1
+        else:
+            self.repair_per_round = math.ceil(repair_ratio * num_chunks)
+            self.num_repair = len(range(channel, self.repair_per_round, channels))
+
+    def symbol(self, pos):
+        if self.num_repair < 0:
+            if pos < self.num_systematic:
+                return self.channel + self.channels * pos
+            return self.num_chunks + self.channel + self.channels * (pos - self.num_systematic)
+        k, j = divmod(pos, self.num_systematic + self.num_repair)
+        if j < self.num_systematic:
+            return self.channel + self.channels * j
+        j -= self.num_systematic
+        return self.num_chunks + k * self.repair_per_round + self.channel + self.channels * j
+
+class RoundRobinQueue:
+    '''按固定顺序轮流从多个队列取结果，生产者 p 负责第 p, p+n, p+2n... 批，输出顺序确定
+    队列中的每个元素为一批结果（list），get() 逐个返回
+    '''
+    def __init__(self, queues):
+        self.queues = queues
+        self.pos = 0
+        self.ready = deque()
+
+    def get(self):
+        if not self.ready:
+            self.ready.extend(self.queues[self.pos].get())
+            self.pos = (self.pos + 1) % len(self.queues)
+        return self.ready.popleft()
+
+# Decoder
+class SymbolBitmap:
+    '''已接收的 symbol id，每个 id 1 bit，按需扩展（100 万个 symbol 只占 128KB）'''
+    def __init__(self, size=1 << 16):
+        self.bits = bytearray(size >> 3)
+        self.count = 0
+
+    def add(self, idx):
+        '''新 id 返回 True，重复返回 False'''
+        byte, bit = idx >> 3, 1 << (idx & 7)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1, 2 * len(self.bits)) - len(self.bits)))
+        if self.bits[byte] & bit:
+            return False
+        self.bits[byte] |= bit
+        self.count += 1
+        return True
+
+    def __contains__(self, idx):
+        byte = idx >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (idx & 7)))
+
+    def __len__(self):
+        return self.count
+
 def png_to_video(image_dir, output_path, fps=24):
     command = [
         "ffmpeg",
@@ -0,0 +1,237 @@
+'''
+Linux X11 截屏：MIT-SHM 共享内存，零拷贝
+
+XShmGetImage 由 X server 直接把屏幕区域写入与本进程共享的内存段，缓冲区在多次截取间复用，
+capture() 返回该缓冲区上的 RGB numpy 视图（BGRX 反向切片，不复制，不经过 PIL），
+视图在下一次 capture 前有效。只依赖 libX11/libXext（ctypes 加载），libXrandr 可选（多显示器）。
+可在 Xvfb 下测试：
+    Xvfb :99 -screen 0 1920x1080x24 &
+    DISPLAY=:99 python xshm.py -N 300
+'''
+import ctypes
+import ctypes.util
+import os
+import time
+import numpy as np
+from ctypes import c_int, c_uint, c_ulong, c_void_p, c_char_p, POINTER, byref
+
+ZPixmap = 2
+LSBFirst = 0
+ALL_PLANES = c_ulong(-1).value
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+class XImage(ctypes.Structure):
+    # 只声明用到的前缀字段，XImage 由 Xlib 分配
+    _fields_ = [
+        ('width', c_int), ('height', c_int), ('xoffset', c_int), ('format', c_int),
+        ('data', c_void_p),
+        ('byte_order', c_int), ('bitmap_unit', c_int), ('bitmap_bit_order', c_int), ('bitmap_pad', c_int),
+        ('depth', c_int), ('bytes_per_line', c_int), ('bits_per_pixel', c_int),
+        ('red_mask', c_ulong), ('green_mask', c_ulong), ('blue_mask', c_ulong),
+    ]
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [('shmseg', c_ulong), ('shmid', c_int), ('shmaddr', c_void_p), ('readOnly', c_int)]
+
+class XRRMonitorInfo(ctypes.Structure):
+    _fields_ = [
+        ('name', c_ulong), ('primary', c_int), ('automatic', c_int), ('noutput', c_int),
+        ('x', c_int), ('y', c_int), ('width', c_int), ('height', c_int),
+        ('mwidth', c_int), ('mheight', c_int), ('outputs', c_void_p),
+    ]
+
+_libs = None
+
+def load_libs():
+    '''返回 (libX11, libXext, libc)，找不到时抛出 ImportError'''
+    global _libs
+    if _libs is not None:
+        return _libs
+    def find(name):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            raise ImportError(f"lib{name} not found, XShm capture needs libX11 and libXext")
+        return ctypes.CDLL(path, use_errno=True)
+    x11, xext, libc = find('X11'), find('Xext'), find('c')
+
+    x11.XOpenDisplay.argtypes = [c_char_p]
+    x11.XOpenDisplay.restype = c_void_p
+    x11.XCloseDisplay.argtypes = [c_void_p]
+    x11.XDefaultScreen.argtypes = [c_void_p]
+    x11.XRootWindow.argtypes = [c_void_p, c_int]
+    x11.XRootWindow.restype = c_ulong
+    x11.XDefaultVisual.argtypes = [c_void_p, c_int]
+    x11.XDefaultVisual.restype = c_void_p
+    x11.XDefaultDepth.argtypes = [c_void_p, c_int]
+    x11.XDisplayWidth.argtypes = [c_void_p, c_int]
+    x11.XDisplayHeight.argtypes = [c_void_p, c_int]
+    x11.XSync.argtypes = [c_void_p, c_int]
+    x11.XDestroyImage.argtypes = [POINTER(XImage)]
+
+    xext.XShmQueryExtension.argtypes = [c_void_p]
+    xext.XShmCreateImage.argtypes = [c_void_p, c_void_p, c_uint, c_int, c_void_p, POINTER(XShmSegmentInfo), c_uint, c_uint]
+    xext.XShmCreateImage.restype = POINTER(XImage)
+    xext.XShmAttach.argtypes = [c_void_p, POINTER(XShmSegmentInfo)]
+    xext.XShmDetach.argtypes = [c_void_p, POINTER(XShmSegmentInfo)]
+    xext.XShmGetImage.argtypes = [c_void_p, c_ulong, POINTER(XImage), c_int, c_int, c_ulong]
+
+    libc.shmget.argtypes = [c_int, ctypes.c_size_t, c_int]
+    libc.shmat.argtypes = [c_int, c_void_p, c_int]
+    libc.shmat.restype = c_void_p
+    libc.shmdt.argtypes = [c_void_p]
+    libc.shmctl.argtypes = [c_int, c_int, c_void_p]
+    _libs = (x11, xext, libc)
+    return _libs
+
+def open_display(display=None):
+    x11 = load_libs()[0]
+    d = x11.XOpenDisplay(display.encode() if display else None)
+    if not d:
+        raise RuntimeError(f"Cannot open X display '{display or os.environ.get('DISPLAY', '')}'")
+    return d
+
+def list_monitors(display=None):
+    '''与 mss.monitors 相同的格式：[0] 为整个屏幕，[1:] 为各个显示器（需要 libXrandr，否则同 [0]）'''
+    x11 = load_libs()[0]
+    d = open_display(display)
+    try:
+        screen = x11.XDefaultScreen(d)
+        root = {"left": 0, "top": 0, "width": x11.XDisplayWidth(d, screen), "height": x11.XDisplayHeight(d, screen)}
+        monitors = [root]
+        path = ctypes.util.find_library('Xrandr')
+        if path is not None:
+            xrandr = ctypes.CDLL(path)
+            xrandr.XRRGetMonitors.argtypes = [c_void_p, c_ulong, c_int, POINTER(c_int)]
+            xrandr.XRRGetMonitors.restype = POINTER(XRRMonitorInfo)
+            xrandr.XRRFreeMonitors.argtypes = [POINTER(XRRMonitorInfo)]
+            n = c_int(0)
+            info = xrandr.XRRGetMonitors(d, x11.XRootWindow(d, screen), 1, byref(n))
+            if info:
+                monitors += [{"left": m.x, "top": m.y, "width": m.width, "height": m.height} for m in info[:n.value]]
+                xrandr.XRRFreeMonitors(info)
+        if len(monitors) == 1:
+            monitors.append(dict(root))
+        return monitors
+    finally:
+        x11.XCloseDisplay(d)
+
+class XShmCapture:
+    '''截取根窗口上 (left, top, width, height) 区域，width/height 为 0 表示到屏幕边缘'''
+    def __init__(self, left=0, top=0, width=0, height=0, display=None):
+        x11, xext, libc = self.libs = load_libs()
+        self.display = d = open_display(display)
+        self.image = None
+        self.shminfo = None
+        try:
+            if not xext.XShmQueryExtension(d):
+                raise RuntimeError("X server does not support MIT-SHM")
+            screen = x11.XDefaultScreen(d)
+            self.root = x11.XRootWindow(d, screen)
+            self.left, self.top = left, top
+            self.width = width or x11.XDisplayWidth(d, screen) - left
+            self.height = height or x11.XDisplayHeight(d, screen) - top
+
+            shminfo = XShmSegmentInfo()
+            image = xext.XShmCreateImage(d, x11.XDefaultVisual(d, screen), x11.XDefaultDepth(d, screen), ZPixmap,
+                                         None, byref(shminfo), self.width, self.height)
+            if not image:
+                raise RuntimeError("XShmCreateImage failed")
+            self.image = image
+            img = image.contents
+            if img.bits_per_pixel != 32 or img.byte_order != LSBFirst or img.red_mask != 0xff0000:
+                raise RuntimeError(f"Unsupported X visual: depth {img.depth} bpp {img.bits_per_pixel} red mask {img.red_mask:#x}")
+
+            size = img.bytes_per_line * img.height
+            shminfo.shmid = libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+            if shminfo.shmid < 0:
+                raise OSError(ctypes.get_errno(), "shmget failed")
+            addr = libc.shmat(shminfo.shmid, None, 0)
+            if addr is None or addr == c_void_p(-1).value:
+                libc.shmctl(shminfo.shmid, IPC_RMID, None)
+                raise OSError(ctypes.get_errno(), "shmat failed")
+            shminfo.shmaddr = img.data = addr
+            shminfo.readOnly = 0
+            attached = xext.XShmAttach(d, byref(shminfo))
+            x11.XSync(d, 0)
+            # X server attach 之后即可标记删除，两端都 detach 后系统自动回收，异常退出也不会残留
+            libc.shmctl(shminfo.shmid, IPC_RMID, None)
+            if not attached:
+                libc.shmdt(addr)
+                raise RuntimeError("XShmAttach failed")
+            self.shminfo = shminfo
+        except Exception:
+            self.close(quiet=True)
+            raise
+
+        buf = (ctypes.c_ubyte * size).from_address(addr)
+        bgrx = np.ctypeslib.as_array(buf).reshape(img.height, img.bytes_per_line // 4, 4)[:, :self.width]
+        self.frame = bgrx[:, :, 2::-1]  # RGB 视图，不复制
+        self.captured = 0
+        self.t_first = None
+
+    def capture(self):
+        '''截取一帧，返回共享缓冲区上的 (height, width, 3) RGB 视图'''
+        _, xext, _ = self.libs
+        if not xext.XShmGetImage(self.display, self.root, self.image, self.left, self.top, ALL_PLANES):
+            raise RuntimeError("XShmGetImage failed")
+        if self.t_first is None:
+            self.t_first = time.perf_counter()
+        self.captured += 1
+        return self.frame
+
+    @property
+    def fps(self):
+        '''从第一帧开始的平均截屏速率'''
+        if self.captured < 2:
+            return 0.0
+        return (self.captured - 1) / max(time.perf_counter() - self.t_first, 1e-9)
+
+    def close(self, quiet=False):
+        if self.display is None:
+            return
+        if not quiet:
+            print(f"XShm capture: captured {self.captured} {self.fps:.1f}fps")
+        x11, xext, libc = self.libs
+        self.frame = None
+        if self.shminfo is not None:
+            xext.XShmDetach(self.display, byref(self.shminfo))
+            x11.XSync(self.display, 0)
+            libc.shmdt(self.shminfo.shmaddr)
+        if self.image:
+            x11.XDestroyImage(self.image)  # XShm 图像的 destroy 不释放 data
+        x11.XCloseDisplay(self.display)
+        self.display = None
+
+if __name__ == "__main__":
+    # 截屏速率对比：DISPLAY=:99 python xshm.py -R 1:800:600:0:0 -N 300
+    import argparse
+    from util import parse_region_mon, parse_region, timer
+    parser = argparse.ArgumentParser(description="Benchmark XShm screen capture.")
+    parser.add_argument("-R", "--region", default="", help="capture region, mon_id:width:height:offset_left:offset_top, same as decoder.py")
+    parser.add_argument("-N", "--num-frames", type=int, default=300, help="frames to capture")
+    args = parser.parse_args()
+
+    region_split = args.region.split(':')
+    mon = list_monitors()[parse_region_mon(region_split)]
+    width, height, x, y = parse_region(region_split[1:], mon["width"], mon["height"], fit_pixel=mon["height"]*3//4)
+    capture = XShmCapture(mon["left"] + x, mon["top"] + y, width, height)
+    print(f"Capture region: {width}x{height}+{mon['left'] + x}+{mon['top'] + y}")
+    for _ in range(args.num_frames):
+        frame = capture.capture()
+    capture.close()
+    try:
+        import mss
+        from PIL import Image
+    except ImportError:
+        pass
+    else:
+        # 对比 screen_mss 的路径：grab + Image.frombytes
+        with mss.mss() as sct:
+            monitor = {"left": mon["left"] + x, "top": mon["top"] + y, "width": width, "height": height}
+            tim = timer()
+            for _ in range(args.num_frames):
+                sct_img = sct.grab(monitor)
+                Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+            print(f"mss capture: captured {args.num_frames} {args.num_frames/tim.elapsed():.1f}fps")